@@ -0,0 +1,88 @@
+"""Benchmark: threshold evaluation for one entity with many rules, linear scan vs ThresholdIndex.
+
+Usage: python bench_thresholds.py [rules=1000] [events=2000]
+"""
+import random
+import sys
+import time
+
+from threshold_index import ThresholdIndex, OPERATORS
+
+def _satisfies(op, value, threshold):
+    if op == ">":
+        return value > threshold
+    if op == ">=":
+        return value >= threshold
+    if op == "<":
+        return value < threshold
+    return value <= threshold
+
+def linear_crossed(rows, old_state, new_state):
+    """What a per-row loop has to do: parse both values and test every rule."""
+    out = []
+    for row in rows:
+        try:
+            new_val = float(new_state)
+            thresh_val = float(row[6])
+        except (TypeError, ValueError):
+            continue
+        try:
+            was = _satisfies(row[5], float(old_state), thresh_val)
+        except (TypeError, ValueError):
+            was = False
+        if not was and _satisfies(row[5], new_val, thresh_val):
+            out.append(row)
+    return out
+
+def make_rows(n, rng):
+    # Stored thresholds are REAL, i.e. already floats; the scan still re-parses per row.
+    return [
+        (f"user{i}", f"{1000 + i}", "threshold", None, None, rng.choice(OPERATORS), round(rng.uniform(-20, 40), 1), None, None)
+        for i in range(n)
+    ]
+
+def make_events(n, rng):
+    # A temperature-like random walk, as strings the way HA reports states.
+    value, states = 10.0, []
+    for _ in range(n):
+        value = min(max(value + rng.gauss(0, 0.8), -25), 45)
+        states.append(f"{value:.1f}")
+    return list(zip([None] + states[:-1], states))
+
+def _time_per_event(fn, events):
+    start = time.perf_counter()
+    for old, new in events:
+        fn(old, new)
+    return (time.perf_counter() - start) / len(events)
+
+def main(argv):
+    n_rules = int(argv[0]) if argv else 1000
+    n_events = int(argv[1]) if len(argv) > 1 else 2000
+    rng = random.Random(42)
+    rows = make_rows(n_rules, rng)
+    events = make_events(n_events, rng)
+
+    start = time.perf_counter()
+    index = ThresholdIndex(rows)
+    build = time.perf_counter() - start
+
+    matched = 0
+    for old, new in events:
+        fast = index.crossed(old, new)
+        slow = linear_crossed(rows, old, new)
+        if sorted(map(id, fast)) != sorted(map(id, slow)):
+            print(f"MISMATCH for {old} -> {new}: index {len(fast)} vs linear {len(slow)}")
+            return 1
+        matched += len(fast)
+
+    linear = _time_per_event(lambda o, n: linear_crossed(rows, o, n), events)
+    indexed = _time_per_event(index.crossed, events)
+    print(f"{n_rules} threshold rules on one entity, {n_events} events ({matched / n_events:.1f} rules crossed per event)")
+    print(f"  index build:        {build * 1000:9.3f} ms (once per watch change)")
+    print(f"  linear scan:        {linear * 1e6:9.1f} µs/event")
+    print(f"  ThresholdIndex:     {indexed * 1e6:9.1f} µs/event")
+    print(f"  speedup:            {linear / indexed:9.1f}×")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,174 @@
+"""Live status boards (`/hassio board`): one pinned message per channel, edited in place.
+
+A board lists the current state of every entity watched in its channel. State changes only mark
+the board dirty; a per-channel task folds everything that arrived in the meantime into at most
+one edit per BOARD_EDIT_INTERVAL seconds. Board message ids live in the `boards` table so
+restore_boards() can pick them up again after a restart.
+"""
+import asyncio
+import time
+from datetime import datetime, timezone
+import nextcord
+from colorama import Fore
+
+from config import BOARD_EDIT_INTERVAL
+from db import set_board, delete_board, get_boards, get_watched_entities
+from ha_api import fetch_entity_details_many, fetch_all_states, get_readable_state
+from icons import classify_on_off, ON_HEX
+from rule_index import is_pattern_target
+from utils import log
+
+BOARD_TITLE = "Home Assistant status"
+STATE_EMOJI = {"on": "🟡", "off": "🔵"}
+OTHER_EMOJI = "⚪"
+UNAVAILABLE_EMOJI = "⚠️"
+DESCRIPTION_LIMIT = 4000   # Discord caps embed descriptions at 4096
+
+_boards = {}      # channel_id -> message_id
+_channels = {}    # channel_id -> channel object
+_extra = {}       # channel_id -> entity_ids seen via pattern rules
+_states = {}      # entity_id -> latest state seen
+_pending = {}     # channel_id -> Task waiting to edit
+_last_edit = {}   # channel_id -> monotonic time of the last edit
+
+def has_board(channel_id):
+    return int(channel_id) in _boards
+
+def note_state(channel, entity_id, state):
+    """Record a watched entity's new state and schedule a (coalesced) edit of the channel's board."""
+    channel_id = channel.id
+    if channel_id not in _boards:
+        return
+    _states[entity_id] = state
+    _channels[channel_id] = channel
+    # Remembered so pattern-rule matches show up too; literal watches are listed anyway.
+    _extra.setdefault(channel_id, set()).add(entity_id)
+    task = _pending.get(channel_id)
+    if task is None or task.done():
+        _pending[channel_id] = asyncio.ensure_future(_edit_later(channel_id))
+
+async def _edit_later(channel_id):
+    wait = _last_edit.get(channel_id, 0.0) + BOARD_EDIT_INTERVAL - time.monotonic()
+    if wait > 0:
+        await asyncio.sleep(wait)
+    # Anything that changes from here on schedules the next edit.
+    _pending.pop(channel_id, None)
+    try:
+        await _refresh(channel_id)
+    except Exception as e:
+        log(f"Failed to update board in channel {channel_id}: {e}", level="WARNING", color=Fore.YELLOW, icon="⚠️")
+
+def _board_entity_ids(channel_id):
+    targets = {eid for _, eid, *_ in get_watched_entities(str(channel_id))}
+    watched = {eid for eid in targets if not is_pattern_target(eid)}
+    if len(watched) == len(targets):
+        # No pattern rules left, so entities only they matched drop off the board.
+        _extra.pop(channel_id, None)
+        return watched
+    return watched | _extra.get(channel_id, set())
+
+async def _seed_states(entity_ids):
+    missing = [eid for eid in entity_ids if eid not in _states]
+    if not missing:
+        return
+    wanted = set(missing)
+    for st in await fetch_all_states():
+        eid = st.get("entity_id")
+        if eid in wanted:
+            _states[eid] = st.get("state")
+
+async def _render(channel_id):
+    entity_ids = _board_entity_ids(channel_id)
+    await _seed_states(entity_ids)
+    details = await fetch_entity_details_many(entity_ids)
+    entries = []
+    for eid in entity_ids:
+        friendly_name, _, cached_state, device_class = details.get(eid, (None, None, None, None))
+        state = _states.get(eid, cached_state)
+        if state in (None, "unavailable", "unknown"):
+            emoji = UNAVAILABLE_EMOJI
+        else:
+            emoji = STATE_EMOJI.get(classify_on_off(device_class, state), OTHER_EMOJI)
+        entries.append((friendly_name or eid, f"{emoji} **{friendly_name or eid}** — `{get_readable_state(device_class, state)}`"))
+
+    lines, used = [], 0
+    entries.sort(key=lambda e: e[0].lower())
+    for i, (_, line) in enumerate(entries):
+        if used + len(line) + 1 > DESCRIPTION_LIMIT - 20:
+            lines.append(f"… and {len(entries) - i} more")
+            break
+        lines.append(line)
+        used += len(line) + 1
+
+    embed = nextcord.Embed(
+        title=BOARD_TITLE,
+        description="\n".join(lines) or "Nothing is watched in this channel yet.",
+        color=int(ON_HEX.lstrip("#"), 16),
+        timestamp=datetime.now(timezone.utc),
+    )
+    embed.set_footer(text="Last updated")
+    return embed
+
+async def _post(channel, user_id=None):
+    message = await channel.send(embed=await _render(channel.id))
+    try:
+        await message.pin()
+    except (nextcord.Forbidden, nextcord.HTTPException) as e:
+        log(f"Could not pin board in #{channel.name}: {e}", level="WARNING", color=Fore.YELLOW, icon="📌")
+    set_board(channel.id, message.id, user_id)
+    _boards[channel.id] = message.id
+    _channels[channel.id] = channel
+    return message
+
+async def _refresh(channel_id):
+    channel = _channels.get(channel_id)
+    message_id = _boards.get(channel_id)
+    if channel is None or message_id is None:
+        return
+    _last_edit[channel_id] = time.monotonic()
+    embed = await _render(channel_id)
+    try:
+        await channel.get_partial_message(message_id).edit(embed=embed)
+    except nextcord.NotFound:
+        # Someone deleted the board; put it back rather than silently stopping.
+        log(f"Board message in #{channel.name} is gone; posting a new one", level="INFO", icon="📋")
+        await _post(channel)
+
+async def create_board(channel, user_id):
+    """Post (or re-post) this channel's board. Returns the board message."""
+    if channel.id in _boards:
+        await remove_board(channel, delete_message=True)
+    return await _post(channel, user_id)
+
+async def remove_board(channel, delete_message=False):
+    """Stop maintaining the channel's board. Returns False if it had none."""
+    message_id = _boards.pop(channel.id, None)
+    task = _pending.pop(channel.id, None)
+    if task is not None:
+        task.cancel()
+    _extra.pop(channel.id, None)
+    removed = delete_board(channel.id)
+    if delete_message and message_id is not None:
+        try:
+            await channel.get_partial_message(message_id).delete()
+        except (nextcord.NotFound, nextcord.Forbidden, nextcord.HTTPException):
+            pass
+    return removed or message_id is not None
+
+async def restore_boards(bot):
+    """Re-attach to boards saved before a restart and bring them up to date."""
+    restored = 0
+    for channel_id, message_id in get_boards():
+        channel = bot.get_channel(int(channel_id))
+        if channel is None:
+            # Another worker's shard, or the channel no longer exists.
+            continue
+        _boards[channel.id] = int(message_id)
+        _channels[channel.id] = channel
+        try:
+            await _refresh(channel.id)
+            restored += 1
+        except Exception as e:
+            log(f"Failed to restore board in #{channel.name}: {e}", level="WARNING", color=Fore.YELLOW, icon="⚠️")
+    if restored:
+        log(f"Restored {restored} status board(s)", level="INFO", icon="📋")
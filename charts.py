@@ -0,0 +1,208 @@
+"""History charts for `/hassio history`: fetch, downsample (LTTB), render off-loop, cache per time bucket."""
+import asyncio
+import multiprocessing
+from array import array
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from colorama import Fore
+
+from config import CHART_CACHE_DIR
+from ha_api import fetch_history
+from icons import classify_on_off, ON_HEX, OFF_HEX
+from utils import log
+
+CHART_POINTS = 200          # points kept after downsampling (also sets the cache bucket size)
+CHART_SIZE = (800, 300)
+CHART_CACHE_MAX = 256
+OTHER_HEX = "#8a8f98"       # states that are neither on-like nor off-like
+
+_executor = None
+_chart_cache = {}   # (entity_id, period, bucket) -> Path
+_inflight = {}      # same key -> Future while rendering
+
+# ---- Downsampling -------------------------------------------------------------
+def lttb(points, threshold):
+    """Largest-Triangle-Three-Buckets: reduce [(x, y), ...] to `threshold` points, keeping the shape."""
+    n = len(points)
+    if threshold >= n or threshold < 3:
+        return list(points)
+    sampled = [points[0]]
+    every = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        # Average of the *next* bucket is the third triangle vertex.
+        avg_start = int((i + 1) * every) + 1
+        avg_end = min(int((i + 2) * every) + 1, n)
+        span = points[avg_start:avg_end]
+        avg_x = sum(p[0] for p in span) / len(span)
+        avg_y = sum(p[1] for p in span) / len(span)
+
+        ax, ay = points[a]
+        best_area, best = -1.0, int(i * every) + 1
+        for j in range(int(i * every) + 1, int((i + 1) * every) + 1):
+            x, y = points[j]
+            area = abs((ax - avg_x) * (y - ay) - (ax - x) * (avg_y - ay))
+            if area > best_area:
+                best_area, best = area, j
+        sampled.append(points[best])
+        a = best
+    sampled.append(points[-1])
+    return sampled
+
+# ---- Rendering (runs in a worker process) --------------------------------------
+def _hex_rgb(hex_color):
+    h = hex_color.lstrip("#")
+    return (int(h[0:2], 16), int(h[2:4], 16), int(h[4:6], 16))
+
+def render_history_png(out_path, title, start_label, end_label, series=None, segments=None):
+    """Draw a line chart (`series` of (t, value) normalized to 0..1 in t) or a state timeline
+    (`segments` of (t0, t1, label, hex)) and save it as PNG. Top-level so it pickles."""
+    from PIL import Image, ImageDraw, ImageFont
+
+    w, h = CHART_SIZE
+    left, right, top, bottom = 60, 20, 36, 40
+    im = Image.new("RGB", (w, h), (43, 45, 49))
+    draw = ImageDraw.Draw(im)
+    font = ImageFont.load_default()
+    fg, grid = (220, 221, 222), (70, 73, 80)
+    pw, ph = w - left - right, h - top - bottom
+
+    draw.text((left, 10), title, fill=fg, font=font)
+    draw.rectangle([left, top, left + pw, top + ph], outline=grid)
+    draw.text((left, h - bottom + 8), start_label, fill=fg, font=font)
+    end_w = draw.textlength(end_label, font=font)
+    draw.text((left + pw - end_w, h - bottom + 8), end_label, fill=fg, font=font)
+
+    if series:
+        values = [v for _, v in series]
+        lo, hi = min(values), max(values)
+        if hi == lo:
+            lo, hi = lo - 1, hi + 1
+        for frac in (0.25, 0.5, 0.75):
+            y = top + ph * frac
+            draw.line([(left, y), (left + pw, y)], fill=grid)
+        draw.text((4, top - 4), f"{hi:g}", fill=fg, font=font)
+        draw.text((4, top + ph - 8), f"{lo:g}", fill=fg, font=font)
+        xy = [(left + t * pw, top + ph - (v - lo) / (hi - lo) * ph) for t, v in series]
+        if len(xy) == 1:
+            xy.append((left + pw, xy[0][1]))
+        draw.line(xy, fill=_hex_rgb(ON_HEX), width=2)
+    elif segments:
+        legend = {}
+        for t0, t1, label, hex_color in segments:
+            draw.rectangle([left + t0 * pw, top + ph * 0.25, left + t1 * pw, top + ph * 0.75], fill=_hex_rgb(hex_color))
+            legend.setdefault(label, hex_color)
+        x = left
+        for label, hex_color in list(legend.items())[:8]:
+            draw.rectangle([x, top + ph + 24, x + 10, top + ph + 34], fill=_hex_rgb(hex_color))
+            draw.text((x + 14, top + ph + 24), label, fill=fg, font=font)
+            x += 24 + draw.textlength(label, font=font)
+    else:
+        draw.text((left + pw / 2 - 40, top + ph / 2), "No history", fill=fg, font=font)
+
+    im.save(out_path, format="PNG", optimize=True)
+
+# ---- Data shaping --------------------------------------------------------------
+def _numeric(history):
+    points = []
+    for ts, state in history:
+        try:
+            points.append((ts, float(state)))
+        except (TypeError, ValueError):
+            continue
+    return points
+
+def _shape(history, start_ts, end_ts, device_class):
+    """Return ("series", [...]) for numeric sensors or ("segments", [...]) for state entities."""
+    span = (end_ts - start_ts) or 1
+    norm = lambda ts: min(max((ts - start_ts) / span, 0.0), 1.0)
+    numeric = _numeric(history)
+    if numeric and len(numeric) * 2 >= len(history):
+        # Hold the last value to the right edge, then downsample.
+        numeric.append((end_ts, numeric[-1][1]))
+        return "series", [(norm(ts), v) for ts, v in lttb(numeric, CHART_POINTS)]
+
+    segments = []
+    for i, (ts, state) in enumerate(history):
+        t1 = history[i + 1][0] if i + 1 < len(history) else end_ts
+        if t1 <= start_ts:
+            continue
+        onoff = classify_on_off(device_class, state)
+        hex_color = ON_HEX if onoff == "on" else (OFF_HEX if onoff == "off" else OTHER_HEX)
+        segments.append((norm(ts), norm(t1), str(state), hex_color))
+    return "segments", segments
+
+def _pack_history(history):
+    """[(ts, state), ...] -> (timestamp array, NUL-joined states); pickles several times faster than tuples."""
+    return array("d", [ts for ts, _ in history]), "\0".join(str(state) for _, state in history)
+
+def _shape_and_render(out_path, title, start_ts, end_ts, fmt, times, states, device_class):
+    """Runs in the render process: shaping/LTTB over long histories is too slow for the event loop."""
+    history = list(zip(times, states.split("\0")))
+    kind, data = _shape(history, start_ts, end_ts, device_class)
+    render_history_png(
+        out_path, title,
+        datetime.fromtimestamp(start_ts).strftime(fmt), datetime.fromtimestamp(end_ts).strftime(fmt),
+        data if kind == "series" else None, data if kind == "segments" else None
+    )
+
+# ---- Public API ----------------------------------------------------------------
+def _get_executor():
+    global _executor
+    if _executor is None:
+        # Spawn, not fork: a forked child would inherit the event loop, sockets and locks held by
+        # other threads (e.g. asyncio.to_thread DB writes) mid-use. Spawn re-imports the main
+        # script as __mp_main__, which is why main.py builds the bot under its __main__ guard.
+        _executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+def _remember(key, path):
+    # Drop older buckets of the same (entity, period); they can never be served again.
+    for old in [k for k in _chart_cache if k[:2] == key[:2] and k != key]:
+        _chart_cache.pop(old).unlink(missing_ok=True)
+    _chart_cache[key] = path
+    while len(_chart_cache) > CHART_CACHE_MAX:
+        _chart_cache.pop(next(iter(_chart_cache))).unlink(missing_ok=True)
+
+async def _render(key, entity_id, period, title, device_class):
+    bucket_size = key[2][1]
+    end_ts = (key[2][0] + 1) * bucket_size
+    start_ts = end_ts - period
+    history = await fetch_history(entity_id, start_ts, end_ts)
+
+    CHART_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    out_path = CHART_CACHE_DIR / f"{entity_id}_{int(period)}_{key[2][0]}.png"
+    fmt = "%Y-%m-%d %H:%M" if period > 86400 else "%H:%M"
+    started = time.perf_counter()
+    await asyncio.get_running_loop().run_in_executor(
+        _get_executor(), _shape_and_render, str(out_path), title, start_ts, end_ts, fmt,
+        *_pack_history(history), device_class
+    )
+    log(f"Rendered history chart for {entity_id} ({len(history)} rows) in {(time.perf_counter() - started) * 1000:.0f} ms", level="DEBUG", icon="📈")
+    return out_path
+
+async def get_history_chart(entity_id: str, period: float, title: str, device_class=None) -> Path | None:
+    """Return a PNG path charting `entity_id` over the last `period` seconds.
+
+    Charts are cached per (entity, period, time bucket), with the bucket being period/CHART_POINTS
+    (at least a minute) — i.e. one rendered pixel-column of new data — and concurrent requests
+    for the same chart share one render.
+    """
+    bucket_size = max(60, int(period // CHART_POINTS))
+    key = (entity_id, int(period), (int(time.time() // bucket_size), bucket_size))
+    path = _chart_cache.get(key)
+    if path and path.exists():
+        return path
+    fut = _inflight.get(key)
+    if fut is None:
+        fut = _inflight[key] = asyncio.ensure_future(_render(key, entity_id, period, title, device_class))
+        fut.add_done_callback(lambda _: _inflight.pop(key, None))
+    try:
+        path = await asyncio.shield(fut)
+    except Exception as e:
+        log(f"Failed to render history chart for {entity_id}: {e}", level="WARNING", color=Fore.YELLOW, icon="⚠️")
+        return None
+    _remember(key, path)
+    return path
@@ -2,11 +2,195 @@ from nextcord import Interaction, SlashOption
 from nextcord.ext import commands
 from colorama import Fore
 
-from ha_api import fetch_entity_details, call_ha_assist, fetch_all_entities
-from db import is_watching, add_watch, remove_watch, get_watched_entities
-from utils import log
+from ha_api import get_readable_state, fetch_entity_details, fetch_entity_details_many, call_ha_assist, fetch_all_entities, fetch_entity_index
+from db import is_watching, add_watch, add_watches_bulk, remove_watch, get_watched_entities
+from utils import log, parse_duration, format_duration
+from charts import get_history_chart
+from transition_log import entity_stats
+from datetime import datetime
+from scheduler import PRIORITY_CLASSES, latency_summary
+from views import ConfirmView, PaginatorView, paginate
+from duration_rules import pending_count
+from predicates import is_attribute_condition, compile_condition, predicate_for
+from boards import create_board, remove_board
+from rule_index import is_pattern_target, parse_pattern_target
+from fnmatch import fnmatchcase
+import nextcord
 import re
 
+BULK_PREVIEW_LINES = 20
+DEFAULT_HISTORY_PERIOD = "24h"
+MAX_HISTORY_PERIOD = 30 * 86400
+
+# ---- Condition parsing -------------------------------------------------------
+def parse_condition(condition):
+    """Parse a `/hassio watch` condition into (rule_type, from_state, to_state, operator, threshold).
+
+    Raises ValueError (with a user-facing message) for a non-numeric threshold or a condition
+    that matches none of the forms listed in `/hassio help`.
+    """
+    from_state = to_state = rule_type = "any"
+    operator = threshold = None
+    condition = (condition or "").strip()
+    if not condition or condition.lower() == "any":
+        return rule_type, from_state, to_state, operator, threshold
+    if "->" in condition:
+        from_state, to_state = [s.strip() for s in condition.split("->", 1)]
+        if from_state and to_state:
+            return "state_change", from_state, to_state, operator, threshold
+    else:
+        for op in [">=", "<=", ">", "<"]:
+            if op in condition:
+                parts = condition.split(op)
+                if len(parts) == 2:
+                    try:
+                        threshold = float(parts[1].strip())
+                    except ValueError:
+                        raise ValueError(f"Threshold `{parts[1].strip()}` is not a number.")
+                    return "threshold", from_state, to_state, op, threshold
+                break
+    raise ValueError(
+        f"Couldn't understand the condition `{condition}`. Use e.g. `on -> off`, `>= 37`, `any`, "
+        "`open for 10m` or `attr:battery_level < 20`."
+    )
+
+_PRIORITY_TOKEN = re.compile(r"\bpriority:(\w+)", re.IGNORECASE)
+
+def extract_priority(condition):
+    """Strip a `priority:<class>` token from a condition. Returns (rest, priority or None).
+
+    Raises ValueError for an unknown class.
+    """
+    m = _PRIORITY_TOKEN.search(condition or "")
+    if not m:
+        return condition, None
+    priority = m.group(1).lower()
+    if priority not in PRIORITY_CLASSES:
+        raise ValueError(f"Unknown priority `{priority}`. Use one of: {', '.join(PRIORITY_CLASSES)}.")
+    rest = (condition[:m.start()] + condition[m.end():]).strip()
+    return rest or None, priority
+
+_DURATION_CLAUSE = re.compile(r"(?:^|\s)for\s+(.+)$", re.IGNORECASE)
+
+def extract_duration(condition):
+    """Strip a trailing `for <duration>` clause. Returns (rest, seconds or None).
+
+    A bare state before the clause (`open for 10m`) means "entered that state": `any -> open`.
+    Raises ValueError for an unparseable duration.
+    """
+    m = _DURATION_CLAUSE.search(condition or "")
+    if not m:
+        return condition, None
+    seconds = parse_duration(m.group(1))
+    if not seconds:
+        raise ValueError(f"Invalid duration `{m.group(1)}`. Use something like `90s`, `10m` or `2h`.")
+    rest = condition[:m.start()].strip()
+    if rest and "->" not in rest and not any(op in rest for op in ("<", ">")) and rest.lower() != "any":
+        rest = f"any -> {rest}"
+    return rest or None, seconds
+
+def parse_rule(condition):
+    """Parse a full watch/rule condition. Returns (rule, attribute, priority, duration).
+
+    `rule` is parse_condition()'s tuple; `attr:` conditions are compiled here into a predicate
+    and come back as rule_type 'attribute' with the predicate's operands. Raises ValueError.
+    """
+    condition, priority = extract_priority(condition)
+    if is_attribute_condition(condition):
+        if _DURATION_CLAUSE.search(condition):
+            raise ValueError("`for <duration>` can't be combined with `attr:` conditions.")
+        predicate = compile_condition(condition)
+        return ("attribute", None, predicate.value, predicate.operator, predicate.threshold), predicate.attribute, priority, None
+    condition, duration = extract_duration(condition)
+    return parse_condition(condition), None, priority, duration
+
+# ---- Bulk (pattern) watches --------------------------------------------------
+_FILTER_PREFIXES = ("re:", "domain:", "device_class:")
+
+def is_bulk_target(query):
+    """True if `query` is a glob/regex/domain/device_class filter rather than a single entity."""
+    return any(
+        term.startswith(_FILTER_PREFIXES) or any(ch in term for ch in "*?[")
+        for term in (query or "").split()
+    )
+
+def compile_entity_filter(query):
+    """Compile space-separated filter terms (all must match) into `match(entity_id, details)`.
+
+    Terms: `re:<regex>`, `domain:<domain>`, `device_class:<class>`, or an entity_id glob.
+    Raises re.error on a bad regex.
+    """
+    tests = []
+    for term in query.split():
+        if term.startswith("re:"):
+            rx = re.compile(term[3:])
+            tests.append(lambda eid, d, rx=rx: rx.search(eid) is not None)
+        elif term.startswith("domain:"):
+            domain = term[7:]
+            tests.append(lambda eid, d, domain=domain: eid.split(".", 1)[0] == domain)
+        elif term.startswith("device_class:"):
+            device_class = term[13:]
+            tests.append(lambda eid, d, device_class=device_class: d[3] == device_class)
+        else:
+            tests.append(lambda eid, d, pattern=term: fnmatchcase(eid, pattern))
+    return lambda eid, details: all(test(eid, details) for test in tests)
+
+async def bulk_watch(interaction: Interaction, query, user_id, channel_id, rule, message, priority=None, duration=None, attribute=None):
+    """Resolve a filter against the entity set, preview the matches and add them all in one transaction."""
+    rule_type, from_state, to_state, operator, threshold = rule
+    await interaction.response.defer()
+
+    try:
+        matcher = compile_entity_filter(query)
+    except re.error as e:
+        await interaction.followup.send(f"Invalid regex in `{query}`: {e}")
+        return
+
+    index = await fetch_entity_index()
+    matches = sorted(eid for eid, details in index.items() if matcher(eid, details))
+
+    skipped = 0
+    if rule_type == "threshold":
+        numeric = []
+        for eid in matches:
+            try:
+                float(index[eid][2])
+                numeric.append(eid)
+            except (ValueError, TypeError):
+                skipped += 1
+        matches = numeric
+
+    if not matches:
+        note = f" ({skipped} skipped: not numeric)" if skipped else ""
+        await interaction.followup.send(f"No entities matched `{query}`{note}.")
+        return
+
+    lines = "\n".join(f"- `{eid}` — {index[eid][0] or '(no name)'}" for eid in matches[:BULK_PREVIEW_LINES])
+    more = f"\n…and {len(matches) - BULK_PREVIEW_LINES} more" if len(matches) > BULK_PREVIEW_LINES else ""
+    note = f"\n({skipped} non-numeric entities skipped)" if skipped else ""
+    view = ConfirmView(interaction.user.id)
+    preview = await interaction.followup.send(
+        f"`{query}` matches **{len(matches)}** entities (rule type `{rule_type}`):\n{lines}{more}{note}\n\nWatch all of them in this channel?",
+        view=view,
+        wait=True
+    )
+    await view.wait()
+    if not view.value:
+        await preview.edit(content=f"Cancelled bulk watch for `{query}`.", view=None)
+        return
+
+    added = add_watches_bulk([
+        (user_id, eid, channel_id, rule_type, from_state, to_state, operator, threshold, message, priority, duration, attribute)
+        for eid in matches
+    ])
+    existing = len(matches) - added
+    await preview.edit(
+        content=f"Started watching **{added}** entities matching `{query}` with rule type `{rule_type}`."
+                + (f" ({existing} already watched)" if existing else ""),
+        view=None
+    )
+    log(f"{interaction.user} bulk-watched {added} entities matching {query}", level="INFO", color=Fore.BLUE, icon="👁️")
+
 # ---- Entity resolver ---------------------------------------------------------
 async def resolve_entity_id_or_prompt(interaction: Interaction, query: str):
     """
@@ -75,14 +259,14 @@ def setup_slash_commands(bot):
     )
     async def hassio(interaction: Interaction, action: str = SlashOption(
         description="Command action",
-        choices=["watch", "del", "list", "help", "search"],
+        choices=["watch", "rule", "del", "list", "history", "stats", "board", "queue", "help", "search"],
         required=True
     ), entity_id: str = SlashOption(
-        description="The entity ID (for watch/del)",
+        description="The entity ID (for watch/del) or rule target (for rule)",
         required=False
     ),
     condition: str = SlashOption(
-        description="Optional rule condition",
+        description="Optional rule condition (for history/stats: period such as 6h or 7d; for board: off)",
         required=False
     ),
     message: str = SlashOption(
@@ -105,16 +289,23 @@ def setup_slash_commands(bot):
                 await interaction.response.send_message("You must specify an entity_id to watch.")
                 return
 
+            try:
+                rule, attribute, priority, duration = parse_rule(condition)
+            except ValueError as e:
+                await interaction.response.send_message(str(e))
+                return
+            rule_type, from_state, to_state, operator, threshold = rule
+
+            if is_bulk_target(entity_id):
+                await bulk_watch(interaction, entity_id, user_id, channel_id, rule, message, priority, duration, attribute)
+                return
+
             # Resolve friendly name -> entity_id (ensure exactly one match)
             resolved = await resolve_entity_id_or_prompt(interaction, entity_id)
             if not resolved:
                 return
             entity_id = resolved
 
-            # Parse condition
-            from_state = to_state = rule_type = "any"
-            operator = threshold = None
-
             # Fetch current state to validate against
             friendly_name, icon, current_state, device_class = await fetch_entity_details(entity_id)
             if friendly_name is None and current_state is None:
@@ -124,20 +315,6 @@ def setup_slash_commands(bot):
                 )
                 return
 
-            if condition:
-                if "->" in condition:
-                    from_state, to_state = [s.strip() for s in condition.split("->", 1)]
-                    rule_type = "state_change"
-                elif any(op in condition for op in [">=", "<=", "<", ">"]):
-                    for op in [">=", "<=", ">", "<"]:
-                        if op in condition:
-                            parts = condition.split(op)
-                            if len(parts) == 2:
-                                operator = op
-                                threshold = parts[1].strip()
-                                rule_type = "threshold"
-                                break
-
             # Validate against current state
             if rule_type == "state_change":
                 if from_state and from_state != "any" and from_state != current_state and to_state and to_state != "any" and to_state != current_state:
@@ -155,14 +332,43 @@ def setup_slash_commands(bot):
                     )
                     return
 
-            if is_watching(channel_id, entity_id, from_state, to_state, operator, threshold):
+            if is_watching(entity_id, channel_id, from_state, to_state, operator, threshold, duration, attribute):
                 await interaction.response.send_message(f"You're already watching `{entity_id}` with this condition in this channel.")
                 return
 
-            add_watch(user_id, entity_id, channel_id, rule_type, from_state, to_state, operator, threshold, message)
+            add_watch(user_id, entity_id, channel_id, rule_type, from_state, to_state, operator, threshold, message, priority, duration, attribute)
             await interaction.response.send_message(f"Started watching `{entity_id}` with rule type `{rule_type}`.")
             log(f"{interaction.user} started watching {entity_id}", level="INFO", color=Fore.BLUE, icon="👁️")
 
+        elif action == "rule":
+            target = (entity_id or "").strip()
+            parsed = parse_pattern_target(target)
+            if not parsed:
+                await interaction.response.send_message(
+                    "You must specify a rule target: `domain:<domain>`, `device_class:<class>`, "
+                    "`area:<area>` or an entity_id glob such as `binary_sensor.*_moisture`."
+                )
+                return
+            kind, value = parsed
+            target = value if kind == "glob" else f"{kind}:{value}"
+
+            try:
+                rule, attribute, priority, duration = parse_rule(condition)
+            except ValueError as e:
+                await interaction.response.send_message(str(e))
+                return
+            rule_type, from_state, to_state, operator, threshold = rule
+            if is_watching(target, channel_id, from_state, to_state, operator, threshold, duration, attribute):
+                await interaction.response.send_message(f"This channel already has a `{target}` rule with this condition.")
+                return
+
+            add_watch(user_id, target, channel_id, rule_type, from_state, to_state, operator, threshold, message, priority, duration, attribute)
+            await interaction.response.send_message(
+                f"Added standing rule for `{target}` with rule type `{rule_type}`. "
+                "It also covers matching entities added to Home Assistant later."
+            )
+            log(f"{interaction.user} added pattern rule {target}", level="INFO", color=Fore.BLUE, icon="👁️")
+
         elif action == "del":
             if not entity_id:
                 await interaction.response.send_message("You must specify an ID to delete. Use /hassio list to get the ID.")
@@ -183,23 +389,137 @@ def setup_slash_commands(bot):
             if not rows:
                 await interaction.response.send_message("You're not watching any entities.")
                 return
+            # Name resolution can hit HA on a cold cache; defer so the interaction deadline can't lapse.
+            await interaction.response.defer()
+            details = await fetch_entity_details_many({eid for _, eid, *_ in rows if not is_pattern_target(eid)})
             lines = []
-            for id, eid, rule_type, from_state, to_state, operator, threshold, custom_message in rows:
-                friendly, _, _, _ = await fetch_entity_details(eid)
+            for id, eid, rule_type, from_state, to_state, operator, threshold, custom_message, priority, duration, attribute in rows:
+                if is_pattern_target(eid):
+                    friendly = "pattern rule"
+                else:
+                    friendly = details.get(eid, (None,))[0]
 
                 if rule_type == "state_change":
                     condition_desc = f"{from_state or '*'} → {to_state or '*'}"
                 elif rule_type == "threshold":
-                    condition_desc = f"{operator} {threshold}"
+                    condition_desc = f"{operator} {threshold:g}" if threshold is not None else f"{operator} ?"
+                elif rule_type == "attribute":
+                    condition_desc = predicate_for(attribute, operator, threshold, to_state).describe()
                 elif rule_type == "any":
                     condition_desc = "any state change"
                 else:
                     condition_desc = "(unknown rule)"
 
+                if duration:
+                    condition_desc += f" for {format_duration(duration)}"
+                if priority:
+                    condition_desc += f" priority:{priority}"
                 suffix = f" — " + custom_message if custom_message else ""
                 lines.append(f"- ID `{id}`: `{eid}` ({friendly or '(no name)'}) — `{condition_desc}`{suffix}")
 
-            await interaction.response.send_message("You're watching:\n" + "\n".join(lines))
+            pages = paginate("You're watching:", lines)
+            if len(pages) == 1:
+                await interaction.followup.send(pages[0])
+            else:
+                await interaction.followup.send(pages[0], view=PaginatorView(pages, interaction.user.id))
+
+        elif action == "history":
+            if not entity_id:
+                await interaction.response.send_message("You must specify an entity to chart.")
+                return
+            period_text = (condition or DEFAULT_HISTORY_PERIOD).strip()
+            period = parse_duration(period_text)
+            if not period or period > MAX_HISTORY_PERIOD:
+                await interaction.response.send_message(
+                    f"Invalid period `{period_text}`. Use something like `90m`, `6h` or `7d` (max 30d)."
+                )
+                return
+
+            resolved = await resolve_entity_id_or_prompt(interaction, entity_id)
+            if not resolved:
+                return
+            entity_id = resolved
+
+            await interaction.response.defer()
+            friendly_name, _, _, device_class = await fetch_entity_details(entity_id)
+            title = f"{friendly_name or entity_id} — last {period_text}"
+            chart = await get_history_chart(entity_id, period, title, device_class)
+            if not chart:
+                await interaction.followup.send(f"Couldn’t build a history chart for `{entity_id}`.")
+                return
+            await interaction.followup.send(file=nextcord.File(str(chart), filename="history.png"))
+
+        elif action == "stats":
+            if not entity_id:
+                await interaction.response.send_message("You must specify an entity.")
+                return
+            period_text = (condition or DEFAULT_HISTORY_PERIOD).strip()
+            period = parse_duration(period_text)
+            if not period:
+                await interaction.response.send_message(f"Invalid period `{period_text}`. Use something like `90m`, `6h` or `7d`.")
+                return
+
+            resolved = await resolve_entity_id_or_prompt(interaction, entity_id)
+            if not resolved:
+                return
+            entity_id = resolved
+
+            stats = entity_stats(entity_id, period)
+            friendly_name, _, _, device_class = await fetch_entity_details(entity_id)
+            name = friendly_name or entity_id
+            if not stats["count"] and not stats["last_seen"]:
+                await interaction.response.send_message(
+                    f"No transitions logged for `{name}` yet. Only watched entities are logged."
+                )
+                return
+
+            lines = [f"**{name}** — last {period_text}: {stats['count']} transitions"]
+            for state, n in sorted(stats["entered"].items(), key=lambda kv: -kv[1]):
+                lines.append(f"- `{get_readable_state(device_class, state)}` entered {n}×")
+            if stats["durations"]:
+                lines.append("**Time in state:**")
+                for state, secs in sorted(stats["durations"].items(), key=lambda kv: -kv[1]):
+                    lines.append(f"- `{get_readable_state(device_class, state)}` {format_duration(secs)}")
+            if stats["last_seen"]:
+                lines.append("**Last seen:**")
+                for state, ts in sorted(stats["last_seen"].items(), key=lambda kv: -kv[1]):
+                    when = datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S")
+                    lines.append(f"- `{get_readable_state(device_class, state)}` {when}")
+            await interaction.response.send_message("\n".join(lines)[:2000])
+
+        elif action == "board":
+            if not interaction.guild:
+                await interaction.response.send_message("Status boards only work in server channels.", ephemeral=True)
+                return
+            if (condition or "").strip().lower() == "off":
+                if await remove_board(interaction.channel, delete_message=True):
+                    await interaction.response.send_message("Removed this channel's status board.")
+                    log(f"{interaction.user} removed the board in #{interaction.channel.name}", level="INFO", color=Fore.RED, icon="📋")
+                else:
+                    await interaction.response.send_message("This channel has no status board.", ephemeral=True)
+                return
+            # Rendering may need a full state fetch from HA.
+            await interaction.response.defer(ephemeral=True)
+            board = await create_board(interaction.channel, user_id)
+            await interaction.followup.send(
+                f"Status board ready: {board.jump_url}\n"
+                "It updates in place; only critical/high priority changes are still posted here as messages.",
+                ephemeral=True
+            )
+            log(f"{interaction.user} created a board in #{interaction.channel.name}", level="INFO", color=Fore.GREEN, icon="📋")
+
+        elif action == "queue":
+            def fmt(seconds):
+                return f"{seconds * 1000:.0f}ms" if seconds is not None else "—"
+            lines = ["**Notification queue** (enqueue → sent latency over recent sends):"]
+            for name, st in latency_summary().items():
+                lines.append(
+                    f"- `{name}`: queued {st['queued']}, sent {st['sent']}, p50 {fmt(st['p50'])}, "
+                    f"p95 {fmt(st['p95'])}, max {fmt(st['max'])}, coalesced {st['coalesced']}, "
+                    f"shed {st['shed']}, failed {st['failed']}"
+                )
+            lines.append(f"Pending `for <duration>` timers: {pending_count()}")
+            await interaction.response.send_message("\n".join(lines), ephemeral=True)
 
         elif action == "search":
             if not entity_id:
@@ -250,17 +570,27 @@ def setup_slash_commands(bot):
             await interaction.response.send_message(
                 "**Home Assistant Bot Usage:**\n"
                 "`/hassio watch <entity_id> [condition] [message]` — Start watching an entity\n"
+                "`/hassio watch <pattern> [condition] [message]` — Watch every match, e.g. `sensor.*_battery`, `re:^light\\.`, `domain:lock`, `device_class:moisture`\n"
+                "`/hassio rule <target> [condition] [message]` — Standing rule for `domain:<d>`, `device_class:<c>`, `area:<a>` or an entity_id glob (covers new entities too)\n"
                 "`/hassio del <watch_id>` — Stop watching a specific watch ID\n"
                 "`/hassio list` — List all entities watched in this channel\n"
+                "`/hassio history <entity_id> [period]` — Chart recent history (period in `condition`, default 24h)\n"
+                "`/hassio stats <entity_id> [period]` — Transition counts, time in state and last seen (from the local log)\n"
+                "`/hassio board [off]` — Keep one pinned, self-updating status message for this channel's watches (`off` removes it)\n"
                 "`/hassio search <string>` — Search available entity names\n"
+                "`/hassio queue` — Per-priority notification queue depth and latency\n"
                 "`/hassio help` — Show this help message\n\n"
                 "**Conditions:**\n"
                 "`on -> off` — Watch for a specific state change\n"
-                "`>= 37` — Watch for numeric threshold conditions\n"
-                "`any` — Watch for any state change (default)\n\n"
+                "`>= 37` — Notify when a numeric value crosses the threshold\n"
+                "`any` — Watch for any state change (default)\n"
+                "`open for 10m`, `on -> idle for 5m`, `> 30 for 15m` — Notify only once the condition has held that long\n"
+                "`attr:battery_level < 20`, `attr:media_title changes`, `attr:brightness changes by 13` — Watch an attribute instead of the state\n"
+                "`priority:critical` — Add to any condition to set the delivery priority (critical/high/normal/low)\n\n"
                 "**Message Template:**\n"
                 "You can customize the notification message using these placeholders:\n"
-                "`{old_state}`, `{new_state}`, `{display_name}`, `{entity_id}`, `{timestamp}`\n"
+                "`{old_state}`, `{new_state}`, `{display_name}`, `{entity_id}`, `{timestamp}`, `{duration}`\n"
+                "Attribute conditions also offer `{attribute}`, `{old_value}` and `{new_value}`\n"
                 "Example: `The {display_name} changed from {old_state} to {new_state} at {timestamp}`"
             )
 
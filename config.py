@@ -20,12 +20,55 @@ MDI_SVG_URL = os.getenv("MDI_SVG_URL", "https://cdn.materialdesignicons.com/6.5.
 MDI_PNG_DIR = os.getenv("MDI_PNG_DIR", "/var/www/html/mdi-pngs/")
 MDI_PNG_URL = os.getenv("MDI_PNG_URL", "https://ex1.us/mdi-pngs/")
 
-# ---- Optional brightness notifications for light.* ----
-# If True, any watched light entity will also notify when its 'brightness' attribute changes.
-BRIGHTNESS_NOTIFICATIONS = True
-# Minimum change to notify (pick ONE rule; percent takes precedence when set):
-# As percent of full 0..255 scale (e.g., 5 means >= ~13 steps). Set to None to disable.
-BRIGHTNESS_MIN_PERCENT = 5
-# Absolute steps on the 0..255 scale (e.g., 16 ≈ ~6%). Used only if percent is None.
-BRIGHTNESS_MIN_DELTA = 16
+# ---- Optional split deployment (one HA ingest process, several notifier workers) ----
+# "all"    — single process: HA websocket, rule evaluation and Discord delivery (default).
+# "ingest" — run ingest.py: owns the HA websocket and publishes state changes on IPC_SOCKET_PATH.
+# "worker" — run main.py as Discord shard WORKER_INDEX of WORKER_COUNT; consumes the IPC stream
+#            and only delivers to channels in guilds owned by its shard.
+HABOT_ROLE = os.getenv("HABOT_ROLE", "all").strip().lower()
+IPC_SOCKET_PATH = os.getenv("IPC_SOCKET_PATH", str(BASE_DIR / "habot.sock"))
+WORKER_INDEX = int(os.getenv("WORKER_INDEX", "0"))
+WORKER_COUNT = int(os.getenv("WORKER_COUNT", "1"))
 
+# ---- Webhook pool ----
+# Busy channels get extra webhooks (up to this many; Discord allows 15 per channel) so sends
+# are spread across several per-webhook rate limits.
+WEBHOOK_POOL_MAX = int(os.getenv("WEBHOOK_POOL_MAX", "3"))
+# A channel counts as busy once it sends this many messages within WEBHOOK_BUSY_WINDOW seconds.
+WEBHOOK_BUSY_SENDS = int(os.getenv("WEBHOOK_BUSY_SENDS", "10"))
+WEBHOOK_BUSY_WINDOW = float(os.getenv("WEBHOOK_BUSY_WINDOW", "10"))
+# Channels whose notifications must arrive strictly in order: one webhook, serialized sends.
+WEBHOOK_ORDERED_CHANNELS = {
+    int(cid.strip()) for cid in os.getenv("WEBHOOK_ORDERED_CHANNELS", "").split(",") if cid.strip().isdigit()
+}
+
+# ---- History charts ----
+CHART_CACHE_DIR = Path(os.getenv("CHART_CACHE_DIR", str(BASE_DIR / "charts")))
+
+# ---- Local transition log (backs /hassio stats) ----
+# The background writer commits every TRANSITION_BATCH_SIZE events or TRANSITION_FLUSH_MS, whichever comes first.
+TRANSITION_BATCH_SIZE = int(os.getenv("TRANSITION_BATCH_SIZE", "100"))
+TRANSITION_FLUSH_MS = int(os.getenv("TRANSITION_FLUSH_MS", "500"))
+TRANSITION_RETENTION_DAYS = int(os.getenv("TRANSITION_RETENTION_DAYS", "30"))
+
+# ---- Notification scheduler ----
+# Concurrent senders (one of them is reserved for critical/high priority).
+SCHEDULER_WORKERS = int(os.getenv("SCHEDULER_WORKERS", "4"))
+# Queued notifications beyond this are shed, least urgent and oldest first (critical/high never are).
+SCHEDULER_MAX_QUEUE = int(os.getenv("SCHEDULER_MAX_QUEUE", "500"))
+
+# ---- Delivery ----
+# Identical notifications for several subscribers in one channel are sent once; set this to
+# also @mention every subscriber on that single message.
+NOTIFY_MENTION_SUBSCRIBERS = os.getenv("NOTIFY_MENTION_SUBSCRIBERS", "false").lower() in ("1", "true", "yes")
+
+# ---- Status boards (/hassio board) ----
+# Minimum seconds between edits of one board; changes in between are folded into the next edit.
+BOARD_EDIT_INTERVAL = float(os.getenv("BOARD_EDIT_INTERVAL", "15"))
+
+# ---- Per-event latency tracing ----
+# Fraction of state changes traced end to end (0 disables). Analyze with `python trace_report.py`.
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+TRACE_PATH = Path(os.getenv("TRACE_PATH", str(BASE_DIR / "traces.jsonl")))
+TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", str(5 * 1024 * 1024)))
+TRACE_BACKUPS = int(os.getenv("TRACE_BACKUPS", "3"))
@@ -1,10 +1,25 @@
 import sqlite3
+import time
 from config import DB_PATH
+from utils import log
 
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("""
+# Bumped on every watch insert/delete so in-memory rule indexes know when to rebuild.
+_watch_generation = 0
+
+def watch_generation():
+    return _watch_generation
+
+def _watches_changed():
+    global _watch_generation
+    _watch_generation += 1
+
+# ---- Schema migrations ---------------------------------------------------------
+# Each migration runs once, in order, inside its own transaction; PRAGMA user_version records
+# how many have been applied. Append new migrations — never edit or reorder shipped ones.
+
+def _migration_1_baseline(cur):
+    """Tables as they existed before versioning (no-ops on databases that already have them)."""
+    cur.execute("""
     CREATE TABLE IF NOT EXISTS watched_entities (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         user_id TEXT NOT NULL,
@@ -19,7 +34,7 @@ def init_db():
         UNIQUE (channel_id, entity_id, from_state, to_state, operator, threshold)
     )
     """)
-    cursor.execute("""
+    cur.execute("""
     CREATE TABLE IF NOT EXISTS entity_cache (
         entity_id TEXT PRIMARY KEY,
         friendly_name TEXT,
@@ -28,50 +43,274 @@ def init_db():
         device_class TEXT
     )
     """)
-    conn.commit()
-    conn.close()
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS transitions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        ts REAL NOT NULL,
+        entity_id TEXT NOT NULL,
+        old_state TEXT,
+        new_state TEXT
+    )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_transitions_entity_ts ON transitions (entity_id, ts)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_transitions_ts ON transitions (ts)")
+
+def _migration_2_watch_indexes(cur):
+    """get_watchers() looks up by entity_id on every event; the UNIQUE key leads with channel_id."""
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_watched_entity ON watched_entities (entity_id)")
+
+def _migration_3_split_rules(cur):
+    """Split watched_entities into shared `rules` (numeric thresholds) and per-channel `subscriptions`.
+
+    Subscription ids keep the old watch ids so `/hassio del` keeps working. watched_entities
+    becomes a read-only view over the join for anything still reading the old shape.
+    """
+    cur.execute("""
+    CREATE TABLE rules (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        rule_type TEXT,
+        from_state TEXT,
+        to_state TEXT,
+        operator TEXT,
+        threshold REAL,
+        message TEXT
+    )
+    """)
+    cur.execute("""
+    CREATE TABLE subscriptions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        channel_id TEXT NOT NULL,
+        entity_id TEXT NOT NULL,
+        rule_id INTEGER NOT NULL REFERENCES rules (id),
+        UNIQUE (entity_id, channel_id, rule_id)
+    )
+    """)
+    cur.execute("CREATE INDEX idx_subscriptions_channel ON subscriptions (channel_id)")
+    cur.execute("CREATE INDEX idx_rules_lookup ON rules (rule_type, from_state, to_state, operator)")
+
+    cur.execute("""
+        SELECT id, user_id, entity_id, channel_id, rule_type, from_state, to_state, operator, threshold, message
+        FROM watched_entities ORDER BY id
+    """)
+    for watch_id, user_id, entity_id, channel_id, *rule in cur.fetchall():
+        rule_id = _get_or_create_rule_v3(cur, *rule)
+        cur.execute("""
+            INSERT OR IGNORE INTO subscriptions (id, user_id, channel_id, entity_id, rule_id)
+            VALUES (?, ?, ?, ?, ?)
+        """, (watch_id, user_id, channel_id, entity_id, rule_id))
 
-def is_watching(entity_id, channel_id, from_state, to_state, operator, threshold):
+    cur.execute("DROP TABLE watched_entities")
+    cur.execute("""
+    CREATE VIEW watched_entities AS
+        SELECT s.id, s.user_id, s.entity_id, s.channel_id,
+               r.rule_type, r.from_state, r.to_state, r.operator, r.threshold, r.message
+        FROM subscriptions s JOIN rules r ON r.id = s.rule_id
+    """)
+
+def _migration_4_subscription_priority(cur):
+    """Optional per-watch priority class (critical/high/normal/low); NULL means derive it."""
+    cur.execute("ALTER TABLE subscriptions ADD COLUMN priority TEXT")
+
+def _migration_5_boards(cur):
+    """One live status board message per channel (`/hassio board`)."""
+    cur.execute("""
+        CREATE TABLE boards (
+            channel_id TEXT PRIMARY KEY,
+            message_id TEXT NOT NULL,
+            created_by TEXT,
+            created_at REAL
+        )
+    """)
+
+def _migration_6_duration_rules(cur):
+    """`for <duration>` conditions: a hold time per rule, and the timers waiting on it."""
+    cur.execute("ALTER TABLE rules ADD COLUMN duration REAL")
+    cur.execute("""
+        CREATE TABLE pending_timers (
+            watch_id INTEGER NOT NULL,
+            entity_id TEXT NOT NULL,
+            channel_id TEXT NOT NULL,
+            state TEXT,
+            since REAL NOT NULL,
+            deadline REAL NOT NULL,
+            PRIMARY KEY (watch_id, entity_id)
+        )
+    """)
+
+def _migration_7_attribute_rules(cur):
+    """Attribute conditions (`attr:<name> ...`): the attribute a rule of type 'attribute' tests."""
+    cur.execute("ALTER TABLE rules ADD COLUMN attribute TEXT")
+
+# How long init_db() waits for another process that is mid-migration.
+MIGRATION_LOCK_TIMEOUT = 60
+
+MIGRATIONS = [
+    _migration_1_baseline,
+    _migration_2_watch_indexes,
+    _migration_3_split_rules,
+    _migration_4_subscription_priority,
+    _migration_5_boards,
+    _migration_6_duration_rules,
+    _migration_7_attribute_rules,
+]
+
+def init_db():
+    """Bring the database up to the latest schema version.
+
+    Safe to run from several processes at once (ingest + workers): each migration step takes the
+    write lock with BEGIN IMMEDIATE and re-reads user_version under it, so only one process
+    applies it and the others see it done.
+    """
+    conn = sqlite3.connect(DB_PATH, isolation_level=None, timeout=MIGRATION_LOCK_TIMEOUT)
+    try:
+        while True:
+            cur = conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                version = cur.execute("PRAGMA user_version").fetchone()[0]
+                if version >= len(MIGRATIONS):
+                    cur.execute("COMMIT")
+                    break
+                migration = MIGRATIONS[version]
+                migration(cur)
+                cur.execute(f"PRAGMA user_version = {version + 1}")
+                cur.execute("COMMIT")
+            except Exception:
+                cur.execute("ROLLBACK")
+                raise
+            log(f"DB migrated to schema v{version + 1} ({migration.__name__})", level="INFO", icon="🗄️")
+    finally:
+        conn.close()
+
+# ---- Watches -----------------------------------------------------------------------
+_WATCH_COLUMNS = """
+    s.user_id, s.channel_id,
+    r.rule_type, r.from_state, r.to_state,
+    r.operator, r.threshold, r.message,
+    s.priority, r.duration, s.id,
+    r.attribute
+"""
+
+def _threshold_value(threshold):
+    """Thresholds are stored as REAL; anything non-numeric becomes NULL."""
+    if threshold is None:
+        return None
+    try:
+        return float(threshold)
+    except (TypeError, ValueError):
+        return None
+
+def _get_or_create_rule_v3(cur, rule_type, from_state, to_state, operator, threshold, message):
+    """_get_or_create_rule as of schema v3 (before rules.duration); used by that migration."""
+    threshold = _threshold_value(threshold)
+    cur.execute("""
+        SELECT id FROM rules
+        WHERE rule_type IS ? AND from_state IS ? AND to_state IS ?
+              AND operator IS ? AND threshold IS ? AND message IS ?
+    """, (rule_type, from_state, to_state, operator, threshold, message))
+    row = cur.fetchone()
+    if row:
+        return row[0]
+    cur.execute("""
+        INSERT INTO rules (rule_type, from_state, to_state, operator, threshold, message)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, (rule_type, from_state, to_state, operator, threshold, message))
+    return cur.lastrowid
+
+def _get_or_create_rule(cur, rule_type, from_state, to_state, operator, threshold, message, duration=None, attribute=None):
+    threshold = _threshold_value(threshold)
+    cur.execute("""
+        SELECT id FROM rules
+        WHERE rule_type IS ? AND from_state IS ? AND to_state IS ?
+              AND operator IS ? AND threshold IS ? AND message IS ? AND duration IS ?
+              AND attribute IS ?
+    """, (rule_type, from_state, to_state, operator, threshold, message, duration, attribute))
+    row = cur.fetchone()
+    if row:
+        return row[0]
+    cur.execute("""
+        INSERT INTO rules (rule_type, from_state, to_state, operator, threshold, message, duration, attribute)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, (rule_type, from_state, to_state, operator, threshold, message, duration, attribute))
+    return cur.lastrowid
+
+def is_watching(entity_id, channel_id, from_state, to_state, operator, threshold, duration=None, attribute=None):
     conn = sqlite3.connect(DB_PATH)
     cur = conn.cursor()
     cur.execute("""
-        SELECT 1 FROM watched_entities
-        WHERE entity_id = ? AND channel_id = ?
-              AND from_state IS ? AND to_state IS ?
-              AND operator IS ? AND threshold IS ?
-    """, (entity_id, channel_id, from_state, to_state, operator, threshold))
+        SELECT 1 FROM subscriptions s JOIN rules r ON r.id = s.rule_id
+        WHERE s.entity_id = ? AND s.channel_id = ?
+              AND r.from_state IS ? AND r.to_state IS ?
+              AND r.operator IS ? AND r.threshold IS ? AND r.duration IS ?
+              AND r.attribute IS ?
+    """, (entity_id, channel_id, from_state, to_state, operator, _threshold_value(threshold), duration, attribute))
     result = cur.fetchone()
     conn.close()
     return result is not None
 
-def add_watch(user_id, entity_id, channel_id, rule_type=None, from_state=None, to_state=None, operator=None, threshold=None, message=None):
+def add_watch(user_id, entity_id, channel_id, rule_type=None, from_state=None, to_state=None, operator=None, threshold=None, message=None, priority=None, duration=None, attribute=None):
     conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("""
-        INSERT INTO watched_entities (
-            user_id, entity_id, channel_id,
-            rule_type, from_state, to_state,
-            operator, threshold, message
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (user_id, entity_id, channel_id, rule_type, from_state, to_state, operator, threshold, message))
-    conn.commit()
-    conn.close()
+    try:
+        with conn:
+            cur = conn.cursor()
+            rule_id = _get_or_create_rule(cur, rule_type, from_state, to_state, operator, threshold, message, duration, attribute)
+            cur.execute("""
+                INSERT OR IGNORE INTO subscriptions (user_id, channel_id, entity_id, rule_id, priority)
+                VALUES (?, ?, ?, ?, ?)
+            """, (user_id, channel_id, entity_id, rule_id, priority))
+    finally:
+        conn.close()
+    _watches_changed()
+
+def add_watches_bulk(rows):
+    """Insert many watches in one transaction, skipping ones that already exist.
+
+    `rows` are (user_id, entity_id, channel_id, rule_type, from_state, to_state, operator, threshold, message, priority, duration, attribute).
+    Returns the number of watches actually added.
+    """
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        with conn:
+            cur = conn.cursor()
+            rule_ids = {}
+            subs = []
+            for user_id, entity_id, channel_id, *rule, priority, duration, attribute in rows:
+                rule = (*rule, duration, attribute)
+                if rule not in rule_ids:
+                    rule_ids[rule] = _get_or_create_rule(cur, *rule)
+                subs.append((user_id, channel_id, entity_id, rule_ids[rule], priority))
+            before = conn.total_changes
+            cur.executemany("""
+                INSERT OR IGNORE INTO subscriptions (user_id, channel_id, entity_id, rule_id, priority)
+                VALUES (?, ?, ?, ?, ?)
+            """, subs)
+            added = conn.total_changes - before
+    finally:
+        conn.close()
+    _watches_changed()
+    return added
 
 def remove_watch(watch_id):
     conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("DELETE FROM watched_entities WHERE id = ?", (watch_id,))
-    deleted = cur.rowcount
-    conn.commit()
-    conn.close()
+    try:
+        with conn:
+            deleted = conn.execute("DELETE FROM subscriptions WHERE id = ?", (watch_id,)).rowcount
+            if deleted:
+                conn.execute("DELETE FROM pending_timers WHERE watch_id = ?", (watch_id,))
+                conn.execute("DELETE FROM rules WHERE id NOT IN (SELECT rule_id FROM subscriptions)")
+    finally:
+        conn.close()
+    _watches_changed()
     return deleted > 0
 
 def get_watched_entities(channel_id):
     conn = sqlite3.connect(DB_PATH)
     cur = conn.cursor()
     cur.execute("""
-        SELECT id, entity_id, rule_type, from_state, to_state, operator, threshold, message
-        FROM watched_entities WHERE channel_id = ?
+        SELECT s.id, s.entity_id, r.rule_type, r.from_state, r.to_state, r.operator, r.threshold, r.message, s.priority, r.duration, r.attribute
+        FROM subscriptions s JOIN rules r ON r.id = s.rule_id
+        WHERE s.channel_id = ? ORDER BY s.id
     """, (channel_id,))
     results = cur.fetchall()
     conn.close()
@@ -80,16 +319,65 @@ def get_watched_entities(channel_id):
 def get_watchers(entity_id):
     conn = sqlite3.connect(DB_PATH)
     cur = conn.cursor()
-    cur.execute("""
-        SELECT user_id, channel_id,
-               rule_type, from_state, to_state,
-               operator, threshold, message
-        FROM watched_entities WHERE entity_id = ?
+    cur.execute(f"""
+        SELECT {_WATCH_COLUMNS}
+        FROM subscriptions s JOIN rules r ON r.id = s.rule_id
+        WHERE s.entity_id = ?
     """, (entity_id,))
     results = cur.fetchall()
     conn.close()
     return results
 
+def get_watch(watch_id):
+    """One watch in get_watchers() shape, or None if it has been deleted."""
+    conn = sqlite3.connect(DB_PATH)
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT {_WATCH_COLUMNS}
+        FROM subscriptions s JOIN rules r ON r.id = s.rule_id
+        WHERE s.id = ?
+    """, (watch_id,))
+    result = cur.fetchone()
+    conn.close()
+    return result
+
+def get_watched_entity_ids():
+    """Distinct watch targets across all channels (literal entity_ids and pattern targets)."""
+    conn = sqlite3.connect(DB_PATH)
+    cur = conn.cursor()
+    cur.execute("SELECT DISTINCT entity_id FROM subscriptions")
+    results = [row[0] for row in cur.fetchall()]
+    conn.close()
+    return results
+
+def get_watched_attributes():
+    """Names of every attribute some attribute rule tests."""
+    conn = sqlite3.connect(DB_PATH)
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT DISTINCT r.attribute FROM rules r
+        WHERE r.attribute IS NOT NULL AND EXISTS (SELECT 1 FROM subscriptions s WHERE s.rule_id = r.id)
+    """)
+    results = {row[0] for row in cur.fetchall()}
+    conn.close()
+    return results
+
+def get_pattern_watchers():
+    """Rows for pattern rules (domain:/device_class:/area: targets or entity_id globs).
+
+    Same columns as get_watchers(), prefixed with the target string.
+    """
+    conn = sqlite3.connect(DB_PATH)
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT s.entity_id, {_WATCH_COLUMNS}
+        FROM subscriptions s JOIN rules r ON r.id = s.rule_id
+        WHERE s.entity_id GLOB '*:*' OR s.entity_id GLOB '*[*?[]*'
+    """)
+    results = cur.fetchall()
+    conn.close()
+    return results
+
 def cache_entity_details(entity_id, friendly_name, icon, state, device_class):
     conn = sqlite3.connect(DB_PATH)
     cur = conn.cursor()
@@ -100,6 +388,18 @@ def cache_entity_details(entity_id, friendly_name, icon, state, device_class):
     conn.commit()
     conn.close()
 
+def cache_entities_bulk(rows):
+    """Refresh many entity_cache rows at once: (entity_id, friendly_name, icon, state, device_class)."""
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        with conn:
+            conn.executemany("""
+                INSERT OR REPLACE INTO entity_cache (entity_id, friendly_name, icon, state, device_class)
+                VALUES (?, ?, ?, ?, ?)
+            """, rows)
+    finally:
+        conn.close()
+
 def get_cached_entity_details(entity_id):
     conn = sqlite3.connect(DB_PATH)
     cur = conn.cursor()
@@ -112,3 +412,124 @@ def get_cached_entity_details(entity_id):
         return row
     return None
 
+
+def get_cached_entity_details_many(entity_ids):
+    """Batch form of get_cached_entity_details: {entity_id: (friendly_name, icon, state, device_class)}."""
+    entity_ids = list(entity_ids)
+    if not entity_ids:
+        return {}
+    conn = sqlite3.connect(DB_PATH)
+    cur = conn.cursor()
+    found = {}
+    # Stay well under SQLite's bound-parameter limit.
+    for i in range(0, len(entity_ids), 500):
+        chunk = entity_ids[i:i + 500]
+        cur.execute(f"""
+            SELECT entity_id, friendly_name, icon, state, device_class FROM entity_cache
+            WHERE entity_id IN ({",".join("?" * len(chunk))})
+        """, chunk)
+        for eid, *details in cur.fetchall():
+            found[eid] = tuple(details)
+    conn.close()
+    return found
+
+def insert_transitions(rows):
+    """Group-commit a batch of (ts, entity_id, old_state, new_state) rows."""
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        with conn:
+            conn.executemany(
+                "INSERT INTO transitions (ts, entity_id, old_state, new_state) VALUES (?, ?, ?, ?)",
+                rows
+            )
+    finally:
+        conn.close()
+
+def prune_transitions(before_ts):
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        with conn:
+            return conn.execute("DELETE FROM transitions WHERE ts < ?", (before_ts,)).rowcount
+    finally:
+        conn.close()
+
+def get_transitions(entity_id, since_ts):
+    """Transitions of `entity_id` since `since_ts` (oldest first), preceded by the last one before it."""
+    conn = sqlite3.connect(DB_PATH)
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT ts, old_state, new_state FROM transitions
+        WHERE entity_id = ? AND ts < ? ORDER BY ts DESC LIMIT 1
+    """, (entity_id, since_ts))
+    before = cur.fetchone()
+    cur.execute("""
+        SELECT ts, old_state, new_state FROM transitions
+        WHERE entity_id = ? AND ts >= ? ORDER BY ts
+    """, (entity_id, since_ts))
+    rows = cur.fetchall()
+    conn.close()
+    return before, rows
+
+def get_last_seen_states(entity_id):
+    """{state: last epoch time the entity entered it} over the whole retained log."""
+    conn = sqlite3.connect(DB_PATH)
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT new_state, MAX(ts) FROM transitions WHERE entity_id = ? GROUP BY new_state
+    """, (entity_id,))
+    results = dict(cur.fetchall())
+    conn.close()
+    return results
+
+# ---- Status boards -----------------------------------------------------------------
+def set_board(channel_id, message_id, user_id=None):
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        with conn:
+            conn.execute("""
+                INSERT INTO boards (channel_id, message_id, created_by, created_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT(channel_id) DO UPDATE SET message_id = excluded.message_id
+            """, (str(channel_id), str(message_id), user_id, time.time()))
+    finally:
+        conn.close()
+
+def delete_board(channel_id):
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        with conn:
+            return conn.execute("DELETE FROM boards WHERE channel_id = ?", (str(channel_id),)).rowcount > 0
+    finally:
+        conn.close()
+
+def get_boards():
+    """[(channel_id, message_id), ...] for every board."""
+    conn = sqlite3.connect(DB_PATH)
+    cur = conn.cursor()
+    cur.execute("SELECT channel_id, message_id FROM boards")
+    results = cur.fetchall()
+    conn.close()
+    return results
+
+# ---- Pending duration timers -------------------------------------------------------
+def save_pending_timers(upserts, deletes):
+    """Apply a batch of timer changes: `upserts` are (watch_id, entity_id, channel_id, state, since, deadline),
+    `deletes` are (watch_id, entity_id)."""
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        with conn:
+            conn.executemany("DELETE FROM pending_timers WHERE watch_id = ? AND entity_id = ?", deletes)
+            conn.executemany("""
+                INSERT OR REPLACE INTO pending_timers (watch_id, entity_id, channel_id, state, since, deadline)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, upserts)
+    finally:
+        conn.close()
+
+def get_pending_timers():
+    """Every persisted timer as (watch_id, entity_id, channel_id, state, since, deadline)."""
+    conn = sqlite3.connect(DB_PATH)
+    cur = conn.cursor()
+    cur.execute("SELECT watch_id, entity_id, channel_id, state, since, deadline FROM pending_timers")
+    results = cur.fetchall()
+    conn.close()
+    return results
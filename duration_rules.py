@@ -0,0 +1,131 @@
+"""`for <duration>` conditions: notify only once a rule's condition has held for the whole duration.
+
+When a timed rule's condition starts holding, a timer keyed by (watch id, entity_id) is armed on
+a TimerWheel; any later event on which the condition no longer holds cancels it. Timers that
+expire are handed to the `on_fire` callback given to start_duration_timers(). Arms and cancels
+are mirrored to the `pending_timers` table in batches once per tick, so timers survive restarts.
+"""
+import asyncio
+import operator
+import time
+from colorama import Fore
+
+from db import save_pending_timers, get_pending_timers
+from timer_wheel import TimerWheel
+from utils import log
+
+TICK_SECONDS = 1.0
+
+_OPERATORS = {">": operator.gt, ">=": operator.ge, "<": operator.lt, "<=": operator.le}
+
+_wheel = TimerWheel(TICK_SECONDS)
+_upserts = {}      # (watch_id, entity_id) -> pending_timers row
+_deletes = set()   # (watch_id, entity_id)
+_due = []          # timers that elapsed between ticks, fired on the next one
+_runner = None
+
+def is_timed(row):
+    """True for watch rows (get_watchers shape) carrying a `for <duration>` clause."""
+    return len(row) > 9 and bool(row[9])
+
+def _threshold_holds(row, state):
+    try:
+        return _OPERATORS[row[5]](float(state), float(row[6]))
+    except (KeyError, TypeError, ValueError):
+        return False
+
+def _starts(row, old_state, new_state):
+    """Does this event make the rule's condition start holding?"""
+    rule_type = row[2]
+    if rule_type == "threshold":
+        # Crossing into the range, like untimed threshold rules; staying above it after a fire doesn't re-arm.
+        return _threshold_holds(row, new_state) and not _threshold_holds(row, old_state)
+    if old_state == new_state:
+        return False
+    if rule_type == "state_change":
+        return (row[3] in (None, "any") or row[3] == old_state) and (row[4] in (None, "any") or row[4] == new_state)
+    return True
+
+def holds(row, armed_state, current_state):
+    """Does a timed rule armed in `armed_state` still hold with the entity in `current_state`?"""
+    if row[2] == "threshold":
+        return _threshold_holds(row, current_state)
+    # State rules hold while the entity stays in the state that armed the timer.
+    return current_state == armed_state
+
+def _persist(key, timer=None):
+    if timer is None:
+        _upserts.pop(key, None)
+        _deletes.add(key)
+    else:
+        _deletes.discard(key)
+        p = timer.payload
+        _upserts[key] = (key[0], key[1], p["channel_id"], p["state"], p["since"], timer.deadline)
+
+def track(entity_id, channel_id, row, old_state, new_state, now=None):
+    """Arm, keep or cancel the timer of one timed rule for this state change. O(1)."""
+    key = (row[10], entity_id)
+    now = time.time() if now is None else now
+    timer = _wheel.get(key)
+    if timer is not None:
+        if timer.deadline <= now:
+            # The condition held for the full duration; the wheel just hasn't ticked yet.
+            _due.append(_wheel.cancel(key))
+            _persist(key)
+        elif holds(row, timer.payload["state"], new_state):
+            timer.payload["state"] = new_state
+            return
+        else:
+            _wheel.cancel(key)
+            _persist(key)
+    if _starts(row, old_state, new_state):
+        timer = _wheel.schedule(key, now + row[9], {"channel_id": str(channel_id), "state": new_state, "since": now})
+        _persist(key, timer)
+
+async def _flush():
+    if not _upserts and not _deletes:
+        return
+    upserts, deletes = list(_upserts.values()), list(_deletes)
+    _upserts.clear()
+    _deletes.clear()
+    try:
+        await asyncio.to_thread(save_pending_timers, upserts, deletes)
+    except Exception as e:
+        log(f"Failed to persist {len(upserts) + len(deletes)} duration timer changes: {e}", level="WARNING", color=Fore.YELLOW, icon="⚠️")
+
+async def _run(on_fire):
+    while True:
+        await asyncio.sleep(TICK_SECONDS)
+        expired = _due + _wheel.advance()
+        _due.clear()
+        for timer in expired:
+            _persist(timer.key)
+            watch_id, entity_id = timer.key
+            p = timer.payload
+            try:
+                await on_fire(entity_id, watch_id, p["channel_id"], p["state"], p["since"])
+            except Exception as e:
+                log(f"Duration rule {watch_id} for {entity_id} failed to fire: {e}", level="WARNING", color=Fore.YELLOW, icon="⚠️")
+        await _flush()
+
+def start_duration_timers(on_fire, owns_channel=lambda channel_id: True):
+    """Reload persisted timers for channels this process serves and start the tick loop (once).
+
+    `on_fire(entity_id, watch_id, channel_id, state, since)` is awaited for every expired timer.
+    """
+    global _runner
+    if _runner is not None and not _runner.done():
+        return
+    restored = 0
+    for watch_id, entity_id, channel_id, state, since, deadline in get_pending_timers():
+        key = (watch_id, entity_id)
+        if key in _wheel or not owns_channel(channel_id):
+            continue
+        _wheel.schedule(key, deadline, {"channel_id": channel_id, "state": state, "since": since})
+        restored += 1
+    if restored:
+        log(f"Restored {restored} pending duration timer(s)", level="INFO", icon="⏱️")
+    _runner = asyncio.ensure_future(_run(on_fire))
+
+def pending_count():
+    return len(_wheel)
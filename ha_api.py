@@ -1,6 +1,14 @@
+import asyncio
 import aiohttp
+from datetime import datetime, timezone
+import ha_rpc
 from config import HA_URL, HA_ACCESS_TOKEN
-from db import get_cached_entity_details, cache_entity_details
+from db import get_cached_entity_details, get_cached_entity_details_many, cache_entity_details, cache_entities_bulk
+
+# Above this many cache misses, one full /api/states fetch beats per-entity requests.
+BATCH_FULL_FETCH_THRESHOLD = 8
+# Per-entity requests in flight at once when filling a few misses.
+BATCH_CONCURRENCY = 4
 
 DEVICE_CLASS_STATE_MAP = {
     "battery": {"name": "Battery", "state": {"off": "Normal", "on": "Low"}},
@@ -34,6 +42,8 @@ DEVICE_CLASS_STATE_MAP = {
 }
 
 _entity_cache = {}
+# Concurrent cache misses share one in-flight websocket get_states.
+_index_refresh = None
 
 def get_readable_state(device_class: str, state: str) -> str:
     try:
@@ -51,6 +61,12 @@ async def fetch_entity_details(entity_id: str):
         _entity_cache[entity_id] = cached
         return cached
 
+    if ha_rpc.is_connected():
+        # On the warm websocket one get_states refreshes every entity at once.
+        index = await _shared_entity_index()
+        if entity_id in index:
+            return index[entity_id]
+
     url = f"{HA_URL}/api/states/{entity_id}"
     headers = {"Authorization": f"Bearer {HA_ACCESS_TOKEN}"}
 
@@ -70,21 +86,171 @@ async def fetch_entity_details(entity_id: str):
                 return result
             return (None, None, None, None)
 
-async def fetch_all_entities():
+async def fetch_entity_details_many(entity_ids):
+    """Batch form of fetch_entity_details: {entity_id: (friendly_name, icon, state, device_class)}.
+
+    Serves from memory, then one SQLite query, then either a single full-state fetch or a few
+    bounded-concurrency per-entity requests for whatever is still missing.
+    """
+    wanted = set(entity_ids)
+    found = {eid: _entity_cache[eid] for eid in wanted if eid in _entity_cache}
+    missing = wanted - found.keys()
+    if missing:
+        cached = get_cached_entity_details_many(missing)
+        _entity_cache.update(cached)
+        found.update(cached)
+        missing -= cached.keys()
+
+    if missing and (ha_rpc.is_connected() or len(missing) > BATCH_FULL_FETCH_THRESHOLD):
+        index = await fetch_entity_index()
+        for eid in missing:
+            found[eid] = index.get(eid, (None, None, None, None))
+    elif missing:
+        sem = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+        async def one(eid):
+            async with sem:
+                found[eid] = await fetch_entity_details(eid)
+
+        await asyncio.gather(*(one(eid) for eid in missing))
+    return found
+
+async def fetch_all_states():
+    """Return every entity's state object (empty on error), over the websocket when attached."""
+    if ha_rpc.is_connected():
+        try:
+            return await ha_rpc.get_states()
+        except (ha_rpc.HARequestError, asyncio.TimeoutError, ConnectionError):
+            pass
+
     url = f"{HA_URL}/api/states"
     headers = {"Authorization": f"Bearer {HA_ACCESS_TOKEN}"}
 
     async with aiohttp.ClientSession() as session:
         async with session.get(url, headers=headers) as resp:
             if resp.status == 200:
-                data = await resp.json()
-                return {
-                    item["entity_id"]: item["attributes"].get("friendly_name", "")
-                    for item in data
-                }
-            return {}
+                return await resp.json()
+            return []
+
+async def fetch_entity_state(entity_id: str):
+    """Return the entity's live state straight from HA (bypassing every cache), or None on error."""
+    url = f"{HA_URL}/api/states/{entity_id}"
+    headers = {"Authorization": f"Bearer {HA_ACCESS_TOKEN}"}
+
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.get(url, headers=headers) as resp:
+                if resp.status == 200:
+                    return (await resp.json()).get("state")
+    except aiohttp.ClientError:
+        pass
+    return None
+
+async def fetch_all_entities():
+    return {
+        item["entity_id"]: item["attributes"].get("friendly_name", "")
+        for item in await fetch_all_states()
+    }
+
+async def fetch_entity_index():
+    """Return {entity_id: (friendly_name, icon, state, device_class)} for every entity.
+
+    One `/api/states` round trip; also refreshes the in-memory and SQLite entity caches.
+    """
+    index = {}
+    for item in await fetch_all_states():
+        attributes = item.get("attributes", {})
+        index[item["entity_id"]] = (
+            attributes.get("friendly_name", None),
+            attributes.get("icon", None),
+            item.get("state", None),
+            attributes.get("device_class", None)
+        )
+    if index:
+        _entity_cache.update(index)
+        cache_entities_bulk([(eid, *details) for eid, details in index.items()])
+    return index
+
+async def _shared_entity_index():
+    global _index_refresh
+    if _index_refresh is None or _index_refresh.done():
+        _index_refresh = asyncio.ensure_future(fetch_entity_index())
+    return await asyncio.shield(_index_refresh)
+
+async def fetch_history(entity_id: str, start_ts: float, end_ts: float):
+    """Return [(epoch_seconds, state), ...] for `entity_id` between two epoch times, oldest first."""
+    start = datetime.fromtimestamp(start_ts, timezone.utc).isoformat()
+    end = datetime.fromtimestamp(end_ts, timezone.utc).isoformat()
+
+    if ha_rpc.is_connected():
+        try:
+            result = await ha_rpc.request({
+                "type": "history/history_during_period",
+                "start_time": start,
+                "end_time": end,
+                "entity_ids": [entity_id],
+                "minimal_response": True,
+                "no_attributes": True,
+                "significant_changes_only": False,
+            }, timeout=30)
+            # Compressed rows: {"s": state, "lu": epoch, "lc": epoch (only when != lu)}
+            return [(row.get("lc", row.get("lu")), row.get("s")) for row in (result or {}).get(entity_id, [])]
+        except (ha_rpc.HARequestError, asyncio.TimeoutError, ConnectionError):
+            pass
+
+    url = f"{HA_URL}/api/history/period/{start}"
+    headers = {"Authorization": f"Bearer {HA_ACCESS_TOKEN}"}
+    params = {
+        "filter_entity_id": entity_id,
+        "end_time": end,
+        "minimal_response": "",
+        "no_attributes": "",
+        "significant_changes_only": "0",
+    }
+
+    async with aiohttp.ClientSession() as session:
+        async with session.get(url, headers=headers, params=params) as resp:
+            if resp.status != 200:
+                return []
+            data = await resp.json()
+    rows = data[0] if data else []
+    return [
+        (datetime.fromisoformat(row["last_changed"]).timestamp(), row.get("state"))
+        for row in rows if row.get("last_changed")
+    ]
+
+async def call_service(domain: str, service: str, service_data: dict | None = None):
+    """Call a HA service, over the websocket when attached. Returns True on success."""
+    if ha_rpc.is_connected():
+        try:
+            await ha_rpc.call_service(domain, service, service_data)
+            return True
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        except ha_rpc.HARequestError:
+            return False
+
+    url = f"{HA_URL}/api/services/{domain}/{service}"
+    headers = {
+        "Authorization": f"Bearer {HA_ACCESS_TOKEN}",
+        "Content-Type": "application/json"
+    }
+
+    async with aiohttp.ClientSession() as session:
+        async with session.post(url, headers=headers, json=service_data or {}) as resp:
+            return resp.status == 200
 
 async def call_ha_assist(text: str) -> str:
+    if ha_rpc.is_connected():
+        try:
+            result = await ha_rpc.conversation_process(text)
+            speech = ((result or {}).get("response") or {}).get("speech") or {}
+            return (speech.get("plain") or {}).get("speech") or "No response from Assist."
+        except ha_rpc.HARequestError as e:
+            return f"Error: {e}"
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+
     url = f"{HA_URL}/api/services/conversation/process"
     headers = {
         "Authorization": f"Bearer {HA_ACCESS_TOKEN}",
@@ -104,3 +270,28 @@ async def call_ha_assist(text: str) -> str:
                     return "Unexpected response format from Assist."
             return f"Error {resp.status}: {await resp.text()}"
 
+
+_AREA_TEMPLATE = (
+    "{% for s in states %}{{ s.entity_id }}|{{ area_id(s.entity_id) or '' }}|{{ area_name(s.entity_id) or '' }}\n"
+    "{% endfor %}"
+)
+
+async def fetch_area_map():
+    """Return {entity_id: (area_id, area_name)} for entities assigned to an area (one template render)."""
+    url = f"{HA_URL}/api/template"
+    headers = {
+        "Authorization": f"Bearer {HA_ACCESS_TOKEN}",
+        "Content-Type": "application/json"
+    }
+
+    async with aiohttp.ClientSession() as session:
+        async with session.post(url, headers=headers, json={"template": _AREA_TEMPLATE}) as resp:
+            if resp.status != 200:
+                return None
+            text = await resp.text()
+    areas = {}
+    for line in text.splitlines():
+        parts = line.strip().split("|")
+        if len(parts) == 3 and parts[1]:
+            areas[parts[0]] = (parts[1], parts[2])
+    return areas
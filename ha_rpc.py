@@ -0,0 +1,82 @@
+"""Request/response multiplexer over the listener's authenticated HA websocket.
+
+ha_websocket attaches the socket after auth and routes every `result` frame here via
+resolve(); callers anywhere in the bot can then issue concurrent requests correlated by
+message id instead of opening REST sessions. Callers should catch ConnectionError and fall
+back to REST when no websocket is attached (e.g. in HABOT_ROLE=worker processes).
+"""
+import asyncio
+import itertools
+
+WS_REQUEST_TIMEOUT = 10
+
+class HARequestError(Exception):
+    """HA answered a websocket request with success=false."""
+
+    def __init__(self, error):
+        error = error or {}
+        super().__init__(f"{error.get('code', 'unknown_error')}: {error.get('message', '')}")
+        self.code = error.get("code")
+
+_ws = None
+_pending = {}                  # msg id -> Future awaiting the `result` frame
+_ids = itertools.count(1)      # HA only requires ids to increase within a connection
+
+def new_id():
+    return next(_ids)
+
+def attach(ws):
+    global _ws
+    _ws = ws
+
+def detach():
+    """Forget the socket and fail every in-flight request."""
+    global _ws
+    _ws = None
+    for fut in _pending.values():
+        if not fut.done():
+            fut.set_exception(ConnectionError("HA websocket closed"))
+    _pending.clear()
+
+def is_connected():
+    return _ws is not None and not _ws.closed
+
+def resolve(msg):
+    """Complete the request waiting on this `result` frame. Returns False if nobody was waiting."""
+    fut = _pending.get(msg.get("id"))
+    if fut is None:
+        return False
+    if not fut.done():
+        fut.set_result(msg)
+    return True
+
+async def request(payload, timeout=WS_REQUEST_TIMEOUT, msg_id=None):
+    """Send `payload` with a fresh id and return its `result` (raises HARequestError/TimeoutError/ConnectionError)."""
+    if not is_connected():
+        raise ConnectionError("HA websocket not connected")
+    msg_id = msg_id or new_id()
+    fut = asyncio.get_running_loop().create_future()
+    _pending[msg_id] = fut
+    try:
+        await _ws.send_json({**payload, "id": msg_id})
+        msg = await asyncio.wait_for(fut, timeout)
+    finally:
+        _pending.pop(msg_id, None)
+    if not msg.get("success"):
+        raise HARequestError(msg.get("error"))
+    return msg.get("result")
+
+# ---- Typed helpers -----------------------------------------------------------
+async def get_states(timeout=WS_REQUEST_TIMEOUT):
+    return await request({"type": "get_states"}, timeout=timeout)
+
+async def call_service(domain, service, service_data=None, target=None, timeout=WS_REQUEST_TIMEOUT):
+    payload = {"type": "call_service", "domain": domain, "service": service}
+    if service_data:
+        payload["service_data"] = service_data
+    if target:
+        payload["target"] = target
+    return await request(payload, timeout=timeout)
+
+async def conversation_process(text, timeout=WS_REQUEST_TIMEOUT):
+    return await request({"type": "conversation/process", "text": text}, timeout=timeout)
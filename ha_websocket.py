@@ -1,76 +1,139 @@
+import asyncio
+import time
 import aiohttp
-import sqlite3
-from config import HA_URL, HA_ACCESS_TOKEN, DB_PATH
-from notifier import notify_watchers
-from config import BRIGHTNESS_NOTIFICATIONS
-from utils import log
+from datetime import datetime
+import ha_rpc
+from config import HA_URL, HA_ACCESS_TOKEN
+from db import get_watched_entity_ids, get_watched_attributes
+from rule_index import is_pattern_target
+from tracing import start_trace, mark
+from utils import log, startup_phase
 from colorama import Fore
 
 # --- Internal state for filtered subscriptions ---
 _using_subscribe_entities = False
+_entities_sub_id = None          # id of the live subscribe_entities subscription
+_subscribed_entity_ids = None    # what that subscription covers (None = all entities)
 _last_state_by_eid = {}
 _last_attrs_by_eid = {}
-
-def _next_id():
-    # Simple incremental id generator stored on the function object
-    if not hasattr(_next_id, "i"):
-        _next_id.i = 1
-    _next_id.i += 1
-    return _next_id.i
+# Attributes referenced by some `attr:` rule; attribute-only changes to anything else are dropped.
+_watched_attributes = frozenset()
+# When set (ingest role), state changes go to this coroutine instead of the local notifier.
+_event_sink = None
+# How often to compare the subscription with the watch table (watches may be added by other processes).
+SUBSCRIPTION_REFRESH_SECONDS = 30
+# Backoff between websocket reconnect attempts.
+RECONNECT_MIN_SECONDS = 1
+RECONNECT_MAX_SECONDS = 60
 
 def _distinct_watched_entity_ids():
     """Return a de-duplicated list of all entity_ids being watched (across all channels)."""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cur = conn.cursor()
-        cur.execute("SELECT DISTINCT entity_id FROM watched_entities")
-        rows = cur.fetchall()
-        conn.close()
-        return [r[0] for r in rows if r and r[0]]
+        return [eid for eid in get_watched_entity_ids() if eid]
     except Exception as e:
         log(f"Failed to read watched entity_ids from DB: {e}", level="WARN", color=Fore.YELLOW, icon="⚠️")
         return []
 
-async def _try_subscribe_entities(ws, entity_ids):
-    """Attempt to subscribe to a filtered entity stream. Returns True on success."""
-    global _using_subscribe_entities
-    if not entity_ids:
+def _refresh_watched_attributes():
+    global _watched_attributes
+    try:
+        _watched_attributes = frozenset(get_watched_attributes())
+    except Exception as e:
+        log(f"Failed to read watched attributes from DB: {e}", level="WARN", color=Fore.YELLOW, icon="⚠️")
+
+def _desired_entity_ids():
+    """Sorted literal entity_ids to subscribe to, or None for all entities (pattern rules present)."""
+    ids = _distinct_watched_entity_ids()
+    if any(is_pattern_target(eid) for eid in ids):
+        return None
+    return sorted(ids)
+
+async def _try_subscribe_entities(entity_ids):
+    """Attempt to subscribe to a filtered entity stream. Returns True on success.
+
+    `entity_ids=None` subscribes to every entity (needed by pattern rules, which must also
+    cover entities added to HA later).
+    """
+    global _using_subscribe_entities, _entities_sub_id, _subscribed_entity_ids
+    if entity_ids is not None and not entity_ids:
+        return False
+    msg = {"type": "subscribe_entities"}
+    if entity_ids is not None:
+        msg["entity_ids"] = entity_ids
+
+    # Register the id before sending: the first event can arrive right behind the ack.
+    sub_id = ha_rpc.new_id()
+    previous = _entities_sub_id
+    _entities_sub_id = sub_id
+    try:
+        await ha_rpc.request(msg, msg_id=sub_id)
+    except (ha_rpc.HARequestError, asyncio.TimeoutError, ConnectionError) as e:
+        log(f"subscribe_entities failed: {e}", level="WARN", color=Fore.YELLOW, icon="⚠️")
+        _entities_sub_id = previous
         return False
-    sub_id = _next_id()
-    msg = {"id": sub_id, "type": "subscribe_entities", "entity_ids": entity_ids}
-    await ws.send_json(msg)
-
-    # Expect either an ACK result or an immediate first event.
-    ack = await ws.receive_json()
-    if ack.get("type") == "result":
-        ok = bool(ack.get("success"))
-        _using_subscribe_entities = ok
-        if ok:
-            log(f"Subscribed to {len(entity_ids)} entities via subscribe_entities", level="INFO", color=Fore.CYAN, icon="🎯")
-        return ok
-
-    if ack.get("type") == "event" and "event" in ack:
-        _using_subscribe_entities = True
-        log(f"Subscribed to {len(entity_ids)} entities via subscribe_entities (stream started)", level="INFO", color=Fore.CYAN, icon="🎯")
-        await _process_entities_event(ack)  # prime baseline
-        return True
-
-    return False
-
-async def _subscribe_state_changed(ws):
+
+    _using_subscribe_entities = True
+    _subscribed_entity_ids = entity_ids
+    log(f"Subscribed to {len(entity_ids) if entity_ids is not None else 'all'} entities via subscribe_entities", level="INFO", color=Fore.CYAN, icon="🎯")
+    return True
+
+async def _subscribe_state_changed():
     """Fallback to classic firehose of all state_changed events."""
-    sub_id = _next_id()
-    await ws.send_json({"id": sub_id, "type": "subscribe_events", "event_type": "state_changed"})
+    await ha_rpc.request({"type": "subscribe_events", "event_type": "state_changed"})
     log("Subscribed to all state_changed events (fallback)", level="INFO", color=Fore.WHITE, icon="🌊")
 
-async def _process_entities_event(msg, bot=None):
+async def _subscribe_watched():
+    """Initial subscription after auth: filtered entity stream, else the state_changed firehose."""
+    _refresh_watched_attributes()
+    try:
+        if not await _try_subscribe_entities(_desired_entity_ids()):
+            await _subscribe_state_changed()
+        startup_phase("first subscription", final=True)
+    except Exception as e:
+        log(f"HA subscription failed: {e}", level="ERROR", color=Fore.RED, icon="❌")
+
+async def _refresh_subscription_loop():
+    """Swap the entity subscription on the warm socket when the watched set changes."""
+    while True:
+        await asyncio.sleep(SUBSCRIPTION_REFRESH_SECONDS)
+        _refresh_watched_attributes()
+        if not _using_subscribe_entities:
+            continue
+        wanted = _desired_entity_ids()
+        if wanted == _subscribed_entity_ids or (wanted is not None and not wanted):
+            continue
+        old_id = _entities_sub_id
+        if await _try_subscribe_entities(wanted):
+            try:
+                await ha_rpc.request({"type": "unsubscribe_events", "subscription": old_id})
+            except (ha_rpc.HARequestError, asyncio.TimeoutError, ConnectionError) as e:
+                log(f"Failed to drop old entity subscription {old_id}: {e}", level="WARN", color=Fore.YELLOW, icon="⚠️")
+
+def _parse_ha_time(value):
+    try:
+        return datetime.fromisoformat(value).timestamp() if value else None
+    except (TypeError, ValueError):
+        return None
+
+async def _emit(bot, entity_id, old_state, new_state, old_attrs=None, new_attrs=None, trace=None):
+    """Hand a normalized state change to the IPC publisher (ingest role) or the local notifier."""
+    mark(trace, "process")
+    if _event_sink is not None:
+        await _event_sink(entity_id, old_state, new_state, old_attrs, new_attrs, trace=trace)
+    elif bot is not None:
+        # Imported here so the ingest process never loads the Discord/notifier stack.
+        from notifier import notify_watchers
+        await notify_watchers(bot, entity_id, old_state, new_state, old_attrs, new_attrs, trace=trace)
+
+async def _process_entities_event(msg, bot=None, recv_ts=None):
     """Handle a subscribe_entities event message.
 
     Expected structure (compact diffs):
       event.a = { <eid>: { 's': 'on', 'a': {...}, ... }, ... }        # initial adds/snapshot
       event.c = { <eid>: { '+': { 's': 'off', 'a': {...} } } , ... }  # changes (plus/minus)
       event.r = [ '<eid>', ... ]                                      # removals
-    We only care about 's' (state). We ignore attribute-only updates and baselines.
+    State flips are always forwarded; attribute-only updates only when they touch an attribute
+    some `attr:` rule references. Baselines never notify.
     """
     ev = msg.get("event", {}) or {}
     adds = ev.get("a") or {}
@@ -90,14 +153,16 @@ async def _process_entities_event(msg, bot=None):
         plus = diff.get("+") or {}
         new_state = plus.get("s")
         new_attrs = (plus.get("a") or {})
+        # 'lc' (last_changed) only accompanies state flips; attribute-only diffs carry 'lu'.
+        changed_at = plus.get("lc") or plus.get("lu")
         if new_state is None:
             # Attribute-only change
             old_state = _last_state_by_eid.get(eid)
             old_attrs = _last_attrs_by_eid.get(eid, {})
-            # Only forward attribute-only updates if brightness changed and feature is on
-            if BRIGHTNESS_NOTIFICATIONS and "brightness" in new_attrs:
-                if bot is not None:
-                    await notify_watchers(bot, eid, old_state, old_state, old_attrs, {**old_attrs, **new_attrs})
+            # Only forward attribute-only updates that an attribute rule could care about
+            if not _watched_attributes.isdisjoint(new_attrs):
+                await _emit(bot, eid, old_state, old_state, old_attrs, {**old_attrs, **new_attrs},
+                            trace=start_trace(eid, changed_at, recv_ts))
             # Merge attrs baseline
             if old_attrs:
                 _last_attrs_by_eid[eid] = {**old_attrs, **new_attrs}
@@ -107,10 +172,10 @@ async def _process_entities_event(msg, bot=None):
         old_state = _last_state_by_eid.get(eid)
         old_attrs = _last_attrs_by_eid.get(eid, {})
         if old_state != new_state:
-            if bot is not None:
-                await notify_watchers(bot, eid, old_state, new_state, old_attrs, {**old_attrs, **new_attrs})
+            await _emit(bot, eid, old_state, new_state, old_attrs, {**old_attrs, **new_attrs},
+                        trace=start_trace(eid, changed_at, recv_ts))
         _last_state_by_eid[eid] = new_state
-        # Merge attrs baseline even on state flips (brightness can update too)
+        # Merge attrs baseline even on state flips (attributes often update alongside)
         if new_attrs:
             _last_attrs_by_eid[eid] = {**old_attrs, **new_attrs}
 
@@ -118,53 +183,116 @@ async def _process_entities_event(msg, bot=None):
     for eid in removes:
         _last_state_by_eid.pop(eid, None)
 
-async def start_ha_listener(bot):
-    ws_url = f"{HA_URL.replace('http', 'ws')}/api/websocket"
+async def _process_state_changed_event(msg, bot=None, recv_ts=None):
+    """Handle one classic state_changed event (firehose fallback)."""
+    event = msg.get("event") or {}
+    data = event.get("data") or {}
+
+    # Extract safely: old_state/new_state may be None or dicts
+    entity_id = data.get("entity_id")
+    old_state_obj = data.get("old_state") or {}
+    new_state_obj = data.get("new_state") or {}
+
+    old_state = old_state_obj.get("state") if isinstance(old_state_obj, dict) else None
+    new_state = new_state_obj.get("state") if isinstance(new_state_obj, dict) else None
+    old_attrs = old_state_obj.get("attributes") if isinstance(old_state_obj, dict) else {}
+    new_attrs = new_state_obj.get("attributes") if isinstance(new_state_obj, dict) else {}
+
+    changed_at = _parse_ha_time(new_state_obj.get("last_changed")) if isinstance(new_state_obj, dict) else None
+
+    # Real state flips
+    if entity_id and (old_state is not None) and (new_state is not None) and (old_state != new_state):
+        await _emit(bot, entity_id, old_state, new_state, old_attrs, new_attrs,
+                    trace=start_trace(entity_id, changed_at, recv_ts))
+        return
+    # Attribute-only: forward when an attribute some rule references changed
+    if entity_id and _watched_attributes and isinstance(new_attrs, dict):
+        old_attrs = old_attrs if isinstance(old_attrs, dict) else {}
+        if any(old_attrs.get(a) != new_attrs.get(a) for a in _watched_attributes):
+            await _emit(bot, entity_id, old_state, new_state, old_attrs, new_attrs,
+                        trace=start_trace(entity_id, changed_at, recv_ts))
+
+async def _consume_events(events, bot):
+    """Handle queued event frames in arrival order, off the websocket read loop."""
+    while True:
+        msg, from_entities_sub, recv_ts = await events.get()
+        try:
+            if from_entities_sub:
+                # Compact entity stream from our subscribe_entities subscription
+                await _process_entities_event(msg, bot=bot, recv_ts=recv_ts)
+            else:
+                await _process_state_changed_event(msg, bot=bot, recv_ts=recv_ts)
+        except Exception as e:
+            log(f"Failed to handle HA event: {e}", level="ERROR", color=Fore.RED, icon="❌")
+
+async def _listen(bot, ws_url):
+    """One websocket session: authenticate, subscribe and pump frames until the socket drops.
+
+    Returns True if the session got as far as auth_ok (so the caller can reset its backoff).
+    """
+    background = []
+    events = asyncio.Queue()
+    authenticated = False
     async with aiohttp.ClientSession() as session:
-        async with session.ws_connect(ws_url) as ws:
+        # No frame size cap: get_states and history replies on a large install run well past
+        # aiohttp's 4 MiB default, which would close the socket.
+        async with session.ws_connect(ws_url, max_msg_size=0) as ws:
             auth_msg = await ws.receive_json()
             log(f"HA: {auth_msg.get('type')}", level="INFO", color=Fore.MAGENTA)
             await ws.send_json({"type": "auth", "access_token": HA_ACCESS_TOKEN})
-            while True:
-                msg = await ws.receive_json()
-
-                # Authentication handshake
-                if msg.get("type") == "auth_ok":
-                    log("Authenticated to HA WebSocket", level="INFO", color=Fore.GREEN, icon="🔐")
-
-                    # Attempt filtered subscription to only watched entity_ids
-                    entity_ids = _distinct_watched_entity_ids()
-                    ok = await _try_subscribe_entities(ws, entity_ids)
-                    if not ok:
-                        await _subscribe_state_changed(ws)
-                    continue
-
-                # If using filtered stream, process compact entity messages
-                if _using_subscribe_entities and msg.get("type") == "event" and "event" in msg and "data" not in msg.get("event", {}):
-                    await _process_entities_event(msg, bot=bot)
-                    continue
-
-                # Fallback handler for classic state_changed events
-                if msg.get("type") == "event":
-                    event = msg.get("event") or {}
-                    data = event.get("data") or {}
-
-                    # Extract safely: old_state/new_state may be None or dicts
-                    entity_id = data.get("entity_id")
-                    old_state_obj = data.get("old_state") or {}
-                    new_state_obj = data.get("new_state") or {}
-
-                    old_state = old_state_obj.get("state") if isinstance(old_state_obj, dict) else None
-                    new_state = new_state_obj.get("state") if isinstance(new_state_obj, dict) else None
-                    old_attrs = old_state_obj.get("attributes") if isinstance(old_state_obj, dict) else {}
-                    new_attrs = new_state_obj.get("attributes") if isinstance(new_state_obj, dict) else {}
-
-                    # Real state flips
-                    if entity_id and (old_state is not None) and (new_state is not None) and (old_state != new_state):
-                        await notify_watchers(bot, entity_id, old_state, new_state, old_attrs, new_attrs)
+            try:
+                background.append(asyncio.create_task(_consume_events(events, bot)))
+                while True:
+                    frame = await ws.receive()
+                    if frame.type != aiohttp.WSMsgType.TEXT:
+                        # CLOSE/CLOSED/ERROR: HA went away (or a frame was rejected); reconnect.
+                        log(f"HA websocket closed ({frame.type.name}): {ws.exception() or frame.extra or ''}", level="WARN", color=Fore.YELLOW, icon="🔌")
+                        break
+                    msg = frame.json()
+                    recv_ts = time.time()
+                    msg_type = msg.get("type")
+
+                    # Authentication handshake
+                    if msg_type == "auth_ok":
+                        log("Authenticated to HA WebSocket", level="INFO", color=Fore.GREEN, icon="🔐")
+                        startup_phase("HA auth")
+                        authenticated = True
+                        ha_rpc.attach(ws)
+                        # Subscribing awaits a result frame, which only this loop can deliver.
+                        background.append(asyncio.create_task(_subscribe_watched()))
+                        background.append(asyncio.create_task(_refresh_subscription_loop()))
                         continue
-                    # Attribute-only: allow brightness flow-through for watched lights
-                    if BRIGHTNESS_NOTIFICATIONS and entity_id and isinstance(new_attrs, dict):
-                        if "brightness" in new_attrs:
-                            await notify_watchers(bot, entity_id, old_state, new_state, old_attrs, new_attrs)
 
+                    # Replies to ha_rpc requests (subscriptions, get_states, call_service, ...)
+                    if msg_type == "result":
+                        ha_rpc.resolve(msg)
+                        continue
+
+                    # Events are handled by a separate task: handlers may await ha_rpc requests
+                    # (e.g. get_states on an entity cache miss) whose result frames only this loop reads.
+                    if msg_type == "event":
+                        events.put_nowait((msg, msg.get("id") == _entities_sub_id, recv_ts))
+            finally:
+                ha_rpc.detach()
+                for task in background:
+                    task.cancel()
+    return authenticated
+
+async def start_ha_listener(bot, sink=None):
+    """Run the HA websocket loop, reconnecting with backoff. `sink` (ingest role) receives state changes instead of `bot`."""
+    global _event_sink, _using_subscribe_entities
+    _event_sink = sink
+    ws_url = f"{HA_URL.replace('http', 'ws')}/api/websocket"
+    delay = RECONNECT_MIN_SECONDS
+    while True:
+        try:
+            if await _listen(bot, ws_url):
+                delay = RECONNECT_MIN_SECONDS
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log(f"HA websocket lost: {e!r}", level="ERROR", color=Fore.RED, icon="❌")
+        _using_subscribe_entities = False
+        log(f"Reconnecting to HA in {delay:g}s", level="WARN", color=Fore.YELLOW, icon="🔄")
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, RECONNECT_MAX_SECONDS)
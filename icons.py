@@ -1,20 +1,26 @@
 from config import MDI_SVG_URL, MDI_PNG_DIR
-import requests
-import cairosvg
 from pathlib import Path
-from PIL import Image
-from config import MDI_PNG_DIR
+
+# requests, cairosvg and PIL are imported on first use (or by warm_up() in a background
+# thread) so they stay off the startup path.
+
+def warm_up():
+    """Import the image stack ahead of the first notification. Safe to run in a thread."""
+    import requests  # noqa: F401
+    import cairosvg  # noqa: F401
+    from PIL import Image  # noqa: F401
 
 def get_icon_path(icon: str) -> Path | None:
     if not icon or not icon.startswith("mdi:"):
         return None
 
     slug = icon[4:]
-    from pathlib import Path
     png_path = Path(MDI_PNG_DIR) / f"{slug}.png"
 
     if not png_path.exists():
         print(f"🔍 Fetching and caching icon: {slug}")
+        import requests
+        import cairosvg
         svg_url = f"{MDI_SVG_URL}{slug}.svg"
         response = requests.get(svg_url)
         if response.status_code == 200:
@@ -83,6 +89,7 @@ def get_colored_icon_path(icon: str, device_class: str | None, state: str | None
     if out_path.exists():
         return out_path
 
+    from PIL import Image
     r,g,b = _parse_hex_rgb(hex_color)
     with Image.open(base_path).convert("RGBA") as im:
         alpha = im.split()[-1]  # keep source alpha
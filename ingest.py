@@ -0,0 +1,22 @@
+"""HA ingest process for the split deployment (HABOT_ROLE=worker on the notifier side).
+
+Owns the Home Assistant websocket and republishes state changes over IPC_SOCKET_PATH
+so several `main.py` workers can evaluate rules and send webhooks in parallel.
+"""
+from utils import startup_phase
+import asyncio
+from db import init_db
+from ha_websocket import start_ha_listener
+from ipc import start_event_publisher, publish_event
+
+startup_phase("imports")
+
+async def run_ingest():
+    init_db()
+    startup_phase("DB init")
+    server = await start_event_publisher()
+    async with server:
+        await start_ha_listener(None, sink=publish_event)
+
+if __name__ == "__main__":
+    asyncio.run(run_ingest())
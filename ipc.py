@@ -0,0 +1,99 @@
+import asyncio
+import json
+import os
+from config import IPC_SOCKET_PATH
+from utils import log, startup_phase
+from colorama import Fore
+
+# A worker that falls this far behind is dropped instead of stalling the ingest loop;
+# it reconnects and carries on from the live stream.
+_MAX_BUFFERED_BYTES = 4 * 1024 * 1024
+# Single events carry full attribute dicts; asyncio's 64 KiB default line limit is too tight.
+_MAX_LINE_BYTES = 1024 * 1024
+_RECONNECT_DELAY = 5
+
+_subscribers = set()
+
+# ---- Ingest side -------------------------------------------------------------
+async def _on_subscriber(reader, writer):
+    _subscribers.add(writer)
+    log(f"IPC: worker connected ({len(_subscribers)} total)", level="INFO", color=Fore.CYAN, icon="🔌")
+    try:
+        # Workers never send anything; block until they hang up.
+        await reader.read()
+    finally:
+        _subscribers.discard(writer)
+        writer.close()
+        log(f"IPC: worker disconnected ({len(_subscribers)} left)", level="INFO", color=Fore.WHITE, icon="🔌")
+
+async def start_event_publisher():
+    """Listen on IPC_SOCKET_PATH for notifier workers. Returns the asyncio server."""
+    if os.path.exists(IPC_SOCKET_PATH):
+        os.unlink(IPC_SOCKET_PATH)
+    server = await asyncio.start_unix_server(_on_subscriber, path=IPC_SOCKET_PATH)
+    log(f"IPC: publishing state changes on {IPC_SOCKET_PATH}", level="INFO", color=Fore.CYAN, icon="📡")
+    return server
+
+async def publish_event(entity_id, old_state, new_state, old_attrs=None, new_attrs=None, trace=None):
+    """Fan a normalized state change out to every connected worker (one JSON line each)."""
+    if not _subscribers:
+        return
+    line = (json.dumps({
+        "entity_id": entity_id,
+        "old_state": old_state,
+        "new_state": new_state,
+        "old_attrs": old_attrs or {},
+        "new_attrs": new_attrs or {},
+        "trace": trace,
+    }, separators=(",", ":"), default=str) + "\n").encode()
+    for writer in list(_subscribers):
+        if writer.is_closing():
+            _subscribers.discard(writer)
+            continue
+        if writer.transport.get_write_buffer_size() > _MAX_BUFFERED_BYTES:
+            log("IPC: dropping worker that stopped reading", level="WARNING", color=Fore.YELLOW, icon="⚠️")
+            _subscribers.discard(writer)
+            writer.close()
+            continue
+        writer.write(line)
+
+# ---- Worker side -------------------------------------------------------------
+async def start_event_subscriber(bot):
+    """Consume the ingest stream forever and hand each event to notify_watchers."""
+    from notifier import notify_watchers
+    while True:
+        try:
+            reader, writer = await asyncio.open_unix_connection(IPC_SOCKET_PATH, limit=_MAX_LINE_BYTES)
+        except OSError as e:
+            log(f"IPC: ingest not reachable at {IPC_SOCKET_PATH}: {e}", level="WARNING", color=Fore.YELLOW, icon="⚠️")
+            await asyncio.sleep(_RECONNECT_DELAY)
+            continue
+
+        log(f"IPC: subscribed to ingest at {IPC_SOCKET_PATH}", level="INFO", color=Fore.GREEN, icon="📡")
+        startup_phase("first subscription", final=True)
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+                    # ValueError: a line over _MAX_LINE_BYTES; the stream can't be resynced.
+                    log(f"IPC: connection to ingest lost: {e}", level="WARNING", color=Fore.YELLOW, icon="⚠️")
+                    break
+                if not line:
+                    break
+                try:
+                    ev = json.loads(line)
+                except ValueError as e:
+                    log(f"IPC: bad event line: {e}", level="WARNING", color=Fore.YELLOW, icon="⚠️")
+                    continue
+                try:
+                    await notify_watchers(
+                        bot, ev.get("entity_id"), ev.get("old_state"), ev.get("new_state"),
+                        ev.get("old_attrs"), ev.get("new_attrs"), trace=ev.get("trace")
+                    )
+                except Exception as e:
+                    # One bad event (locked DB, Discord error, ...) must not stop this worker's stream.
+                    log(f"IPC: failed to handle event for {ev.get('entity_id')}: {e}", level="ERROR", color=Fore.RED, icon="❌")
+        finally:
+            writer.close()
+        await asyncio.sleep(_RECONNECT_DELAY)
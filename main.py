@@ -1,3 +1,4 @@
+from utils import log, startup_phase
 import asyncio
 import aiohttp
 from nextcord.ext import commands
@@ -6,19 +7,23 @@ from nextcord.utils import oauth_url
 from nextcord import Permissions
 
 from config import DISCORD_TOKEN, HA_URL, HA_ACCESS_TOKEN, DISCORD_APPLICATION_ID, GUILD_IDS, GUILD_MODE, DB_PATH
-from utils import log
-from notifier import notify_watchers, get_or_create_webhook
+from config import HABOT_ROLE, WORKER_INDEX, WORKER_COUNT
+from notifier import notify_watchers, get_or_create_webhook, notify_duration_elapsed
 from ha_websocket import start_ha_listener
+from ipc import start_event_subscriber
 from colorama import Fore
 from db import init_db, is_watching, add_watch, remove_watch, get_watched_entities, get_watchers
 from commands import setup_slash_commands
+from icons import warm_up as warm_up_icons
+from boards import restore_boards
+from duration_rules import start_duration_timers
+from functools import partial
 
-intents = nextcord.Intents.default()
-intents.message_content = True
-init_db()
+startup_phase("imports")
 
-bot = commands.Bot(command_prefix="!", intents=intents)
-setup_slash_commands(bot)
+# Built by create_bot() under the __main__ guard: the chart renderer's spawned process
+# re-imports this script as __mp_main__ and must not get a second Bot.
+bot = None
 
 webhook_cache = {}
 
@@ -30,6 +35,7 @@ def get_invite_url() -> str:
     perms.read_message_history = True
     perms.use_slash_commands = True
     perms.manage_webhooks = True
+    perms.manage_messages = True  # pin status boards
     perms.mention_everyone = True
     return oauth_url(
         client_id=DISCORD_APPLICATION_ID,
@@ -37,14 +43,42 @@ def get_invite_url() -> str:
         scopes=["bot", "applications.commands"]
     )
 
-@bot.event
 async def on_ready():
     log(f"Bot connected as {bot.user}", level="INFO", color=Fore.CYAN, icon="🤖")
     for g in bot.guilds:
         log(f"Connected to: {g.name} ({g.id})", level="INFO", color=Fore.CYAN)
     log("Invite your bot using this URL:", level="INFO", color=Fore.GREEN)
     log(get_invite_url(), level="INFO")
-    bot.loop.create_task(start_ha_listener(bot))
+    startup_phase("Discord ready")
+    # Pull in the image stack off the event loop so the first notification doesn't pay for it.
+    bot.loop.run_in_executor(None, warm_up_icons)
+    if HABOT_ROLE == "worker":
+        log(f"Worker {WORKER_INDEX + 1}/{WORKER_COUNT}: consuming events from ingest", level="INFO", color=Fore.CYAN, icon="🧩")
+        bot.loop.create_task(start_event_subscriber(bot))
+    else:
+        bot.loop.create_task(start_ha_listener(bot))
+    bot.loop.create_task(restore_boards(bot))
+    if HABOT_ROLE == "worker":
+        start_duration_timers(partial(notify_duration_elapsed, bot), lambda cid: bot.get_channel(int(cid)) is not None)
+    else:
+        start_duration_timers(partial(notify_duration_elapsed, bot))
 
-bot.run(DISCORD_TOKEN)
+def create_bot():
+    intents = nextcord.Intents.default()
+    intents.message_content = True
+
+    if HABOT_ROLE == "worker":
+        # Each worker is one Discord shard, so guilds (and their channels) are partitioned by shard.
+        new_bot = commands.Bot(command_prefix="!", intents=intents, shard_id=WORKER_INDEX, shard_count=WORKER_COUNT)
+    else:
+        new_bot = commands.Bot(command_prefix="!", intents=intents)
+    setup_slash_commands(new_bot)
+    new_bot.event(on_ready)
+    return new_bot
+
+if __name__ == "__main__":
+    bot = create_bot()
+    init_db()
+    startup_phase("DB init")
+    bot.run(DISCORD_TOKEN)
 
@@ -1,133 +1,210 @@
-try:
-    # Prefer new config knobs, but don't crash if not defined yet
-    from config import HA_URL, HA_ACCESS_TOKEN, BRIGHTNESS_NOTIFICATIONS, BRIGHTNESS_MIN_PERCENT, BRIGHTNESS_MIN_DELTA
-except Exception:
-    from config import HA_URL, HA_ACCESS_TOKEN
-    BRIGHTNESS_NOTIFICATIONS = True
-    BRIGHTNESS_MIN_PERCENT = 5
-    BRIGHTNESS_MIN_DELTA = 16
-from utils import log
-from db import get_watchers
-from ha_api import fetch_entity_details, get_readable_state
+from config import HA_URL, HA_ACCESS_TOKEN
+from config import HABOT_ROLE, WORKER_INDEX, NOTIFY_MENTION_SUBSCRIBERS
+from utils import log, format_duration
+from db import get_watchers, get_watch
+from rule_index import match_pattern_watchers
+from transition_log import record_transition
+from scheduler import PRIORITY_CLASSES, classify, submit
+from boards import has_board, note_state
+from threshold_index import threshold_index
+from duration_rules import is_timed, track, holds
+from predicates import predicate_for_row
+from tracing import mark, finish
+from ha_api import fetch_entity_details, fetch_entity_state, get_readable_state
 from icons import get_colored_icon_path
 from icons import get_icon_path
+from webhooks import get_webhook, send_webhook
 import nextcord
 from nextcord.utils import get
 from colorama import Fore
 from datetime import datetime
+from functools import partial
 
 async def get_or_create_webhook(channel: nextcord.TextChannel) -> nextcord.Webhook:
-    if not hasattr(get_or_create_webhook, "cache"):
-        get_or_create_webhook.cache = {}
-    if channel.id in get_or_create_webhook.cache:
-        return get_or_create_webhook.cache[channel.id]
-    webhooks = await channel.webhooks()
-    for wh in webhooks:
-        if wh.user and wh.user.id == channel.guild.me.id:
-            get_or_create_webhook.cache[channel.id] = wh
-            return wh
-    webhook = await channel.create_webhook(name="HA Bot")
-    get_or_create_webhook.cache[channel.id] = webhook
-    return webhook
-
-    if v is None:
+    return await get_webhook(channel)
+
+async def _deliver(channel, entity_id, display_name, message, colored_path=None, trace=None, mentions=None):
+    mention_text = " ".join(f"<@{user_id}>" for user_id in mentions) if mentions else None
+    try:
+        # If we have a colored icon, put the message in an embed with the icon as an
+        # attachment thumbnail so it shows without needing external hosting.
+        if colored_path:
+            icon_filename = colored_path.name  # e.g., washing-machine.png
+            embed = nextcord.Embed(description=message)
+            embed.set_thumbnail(url=f"attachment://{icon_filename}")
+            # Optional: match embed color to icon tint (pull hex from parent dir)
+            try:
+                tint_hex = colored_path.parent.name  # 'ffc107' or '44739e'
+                embed.color = int(tint_hex, 16)
+            except Exception:
+                pass
+            await send_webhook(
+                channel,
+                content=mention_text,
+                username=display_name,
+                embed=embed,
+                file=nextcord.File(str(colored_path), filename=icon_filename)
+            )
+        else:
+            # No icon available — send a plain text message.
+            await send_webhook(
+                channel,
+                content=f"{mention_text} {message}" if mention_text else message,
+                username=display_name
+            )
+        mark(trace, "sent")
+        finish(trace)
+    except Exception as e:
+        log(f"Failed to send webhook for {entity_id}: {e}", color="YELLOW", icon="⚠️")
+        raise
+
+def _prepare_colored_icon(entity_id, icon, device_class, new_state):
+    # Tint icon based on current *state* (on/off); not brightness level.
+    if not (icon and icon.startswith("mdi:")):
         return None
     try:
-        return round(int(v) * 100 / 255)
-    except Exception:
+        return get_colored_icon_path(icon, device_class, new_state)
+    except Exception as e:
+        log(f"Failed to prepare colored icon for {entity_id}: {e}", color="YELLOW", icon="⚠️")
         return None
 
-def _bri_to_pct(v):
-    if v is None:
+def _resolve_channel(bot, row):
+    user_id, channel_id = row[0], row[1]
+    channel = bot.get_channel(int(channel_id))
+    if not channel and HABOT_ROLE == "worker":
+        # Channel lives in a guild owned by another worker's shard.
         return None
-    try:
-        return round(int(v) * 100 / 255)
-    except Exception:
+    if not channel or not channel.guild:
+        log(f"Could not find valid channel {channel_id} for user {user_id}", color="YELLOW", icon="⚠️")
         return None
+    return channel
 
-def _brightness_changed_enough(old_bri, new_bri):
-    if old_bri is None or new_bri is None:
-        return False
-    try:
-        delta = abs(int(new_bri) - int(old_bri))
-    except Exception:
-        return False
-    if BRIGHTNESS_MIN_PERCENT is not None:
-        return (delta * 100 / 255) >= BRIGHTNESS_MIN_PERCENT
-    return delta >= (BRIGHTNESS_MIN_DELTA or 0)
-
-async def notify_watchers(bot, entity_id, old_state, new_state, old_attrs=None, new_attrs=None):
-    rows = get_watchers(entity_id)
-    friendly_name, icon, current_state, device_class = await fetch_entity_details(entity_id)
+async def _dispatch(entity_id, details, old_state, new_state, matched, trace=None, held_for=None, old_attrs=None, new_attrs=None):
+    """Render and queue notifications for `matched` [(channel, row), ...].
 
+    Matched rows collapse into one send per (channel, rendered message), so several subscribers
+    of the same rule in a channel get a single notification. `held_for` (seconds) marks a
+    `for <duration>` rule that has just elapsed.
+    """
+    friendly_name, icon, _, device_class = details
     display_name = friendly_name or entity_id
-    # Prepare optional attachment-based *colored* icon (tinted & cached per ON/OFF).
-    icon_file = None
-    embed = None
-    if icon and icon.startswith("mdi:"):
-        # Tint icon based on current *state* (on/off); not brightness level.
-        colored_path = get_colored_icon_path(icon, device_class, new_state)
-        if colored_path:
-            icon_filename = colored_path.name  # e.g., washing-machine.png
-            try:
-                icon_file = nextcord.File(str(colored_path), filename=icon_filename)
-                embed = nextcord.Embed()
-                embed.set_thumbnail(url=f"attachment://{icon_filename}")
-                # Optional: match embed color to icon tint (pull hex from parent dir)
-                try:
-                    tint_hex = colored_path.parent.name  # 'ffc107' or '44739e'
-                    embed.color = int(tint_hex, 16)
-                except Exception:
-                    pass
-            except Exception as e:
-                log(f"Failed to prepare colored icon for {entity_id}: {e}", color="YELLOW", icon="⚠️")
-
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
     mapped_old_state = get_readable_state(device_class, old_state)
     mapped_new_state = get_readable_state(device_class, new_state)
+    duration = format_duration(held_for) if held_for else ""
 
-    for row in rows:
-        user_id, channel_id = row[0], row[1]
-        try:
-            user = bot.get_user(int(user_id)) or await bot.fetch_user(int(user_id))
-        except Exception as e:
-            log(f"Failed to fetch user {user_id}: {e}", color="YELLOW", icon="⚠️")
-            user = None
-
-        channel = bot.get_channel(int(channel_id))
-        if not channel or not channel.guild:
-            log(f"Could not find valid channel {channel_id} for user {user.display_name if user else user_id}", color="YELLOW", icon="⚠️")
+    deliveries = {}
+    for channel, row in matched:
+        custom_message = row[7] if len(row) > 7 else None
+        attribute = row[11] if len(row) > 11 else None
+        old_value = (old_attrs or {}).get(attribute) if attribute else None
+        new_value = (new_attrs or {}).get(attribute) if attribute else None
+        if held_for:
+            message = custom_message or f"`{display_name}` has been `{mapped_new_state}` for {duration}"
+        elif attribute:
+            message = custom_message or f"`{display_name}` {attribute} changed to `{new_value}`"
+        else:
+            message = custom_message or f"`{display_name}` changed to `{mapped_new_state}`"
+        message = message.replace("{old_state}", str(mapped_old_state))\
+                           .replace("{new_state}", str(mapped_new_state))\
+                           .replace("{display_name}", display_name)\
+                           .replace("{entity_id}", entity_id)\
+                           .replace("{timestamp}", timestamp)\
+                           .replace("{duration}", duration)\
+                           .replace("{attribute}", str(attribute or ""))\
+                           .replace("{old_value}", str(old_value))\
+                           .replace("{new_value}", str(new_value))
+
+        priority = classify(entity_id, device_class, row[8] if len(row) > 8 else None)
+        if has_board(channel.id) and priority not in ("critical", "high"):
+            # The channel's status board already shows this; only urgent changes get their own message.
             continue
+        plan = deliveries.get((channel.id, message))
+        if plan is None:
+            plan = deliveries[(channel.id, message)] = {"channel": channel, "priority": priority, "users": [], "rules": set()}
+        elif PRIORITY_CLASSES.index(priority) < PRIORITY_CLASSES.index(plan["priority"]):
+            plan["priority"] = priority
+        if row[0] not in plan["users"]:
+            plan["users"].append(row[0])
+        plan["rules"].add(tuple(row[2:8]) + tuple(row[9:10]))
+
+    if not deliveries:
+        if matched:
+            # Matched, but the status board covers it; record how far the event got.
+            finish(trace)
+        return
+
+    # Optional attachment-based *colored* icon (tinted & cached per ON/OFF), prepared once per
+    # event; the File/Embed objects are built per send in _deliver since queued sends run later
+    # and concurrently.
+    colored_path = _prepare_colored_icon(entity_id, icon, device_class, new_state)
+    mark(trace, "render")
+    for (channel_id, message), plan in deliveries.items():
+        if len(plan["users"]) > 1:
+            log(f"Merged {len(plan['users'])} identical notifications for {entity_id} in #{plan['channel'].name}", level="debug")
+        await submit(
+            plan["priority"],
+            partial(
+                _deliver, plan["channel"], entity_id, display_name, message, colored_path, trace,
+                plan["users"] if NOTIFY_MENTION_SUBSCRIBERS else None
+            ),
+            coalesce_key=(channel_id, entity_id, frozenset(plan["rules"]))
+        )
+
+async def notify_watchers(bot, entity_id, old_state, new_state, old_attrs=None, new_attrs=None, trace=None):
+    rows = get_watchers(entity_id) + await match_pattern_watchers(entity_id, new_attrs or old_attrs)
+    if old_state == new_state:
+        # Attribute-only change: state rules (and their timers/boards) have nothing new to see.
+        rows = [row for row in rows if len(row) > 2 and row[2] == "attribute"]
+    if not rows:
+        return
+    if old_state != new_state and (HABOT_ROLE != "worker" or WORKER_INDEX == 0):
+        # Every worker sees every event; only the first one keeps the transition log.
+        record_transition(entity_id, old_state, new_state)
+    details = await fetch_entity_details(entity_id)
+    log(f"{entity_id} ({details[0]}, {details[3]}, icon={details[1]}): {old_state} -> {new_state}", level="debug")
+
+    # Boards show every watched entity's state, so they see the change before any rule filtering
+    # (threshold rows that weren't crossed are dropped below but still belong on the board).
+    if old_state != new_state:
+        for channel_id in {row[1] for row in rows}:
+            if has_board(channel_id):
+                channel = bot.get_channel(int(channel_id))
+                if channel:
+                    note_state(channel, entity_id, new_state)
+
+    # `for <duration>` rules never notify on the event itself; they arm/cancel timers below.
+    timed = [row for row in rows if is_timed(row)]
+    if timed:
+        rows = [row for row in rows if not is_timed(row)]
+
+    # Threshold rules are answered by the sorted per-entity index: only rules whose threshold
+    # was crossed by old -> new come back, so the loop below never sees the rest.
+    threshold_rows = [row for row in rows if len(row) > 2 and row[2] == "threshold"]
+    if threshold_rows:
+        crossed = threshold_index(entity_id, threshold_rows).crossed(old_state, new_state)
+        rows = [row for row in rows if not (len(row) > 2 and row[2] == "threshold")] + crossed
+        log(f"{len(crossed)}/{len(threshold_rows)} threshold rules crossed for {entity_id}", level="debug")
+
+    matched = []
+    for row in timed:
+        channel = _resolve_channel(bot, row)
+        if channel:
+            track(entity_id, channel.id, row, old_state, new_state)
 
-        log(f"friendly_name: {friendly_name}", level="debug")
-        log(f"icon: {icon}", level="debug")
-        log(f"current_state: {current_state}", level="debug")
-        log(f"device_class: {device_class}", level="debug")
-        log(f"display_name: {display_name}", level="debug")
-        log(f"icon_file: {icon_file}", level="debug")
-        log(f"old_state: {old_state}", level="debug")
-        log(f"new_state: {new_state}", level="debug")
-        log(f"mapped_old_state: {mapped_old_state}", level="debug")
-        log(f"mapped_new_state: {mapped_new_state}", level="debug")
-
-        webhook = await get_or_create_webhook(channel)
+    for row in rows:
+        channel = _resolve_channel(bot, row)
+        if not channel:
+            continue
 
         rule_type = row[2] if len(row) > 2 else None
         from_state = row[3] if len(row) > 3 else None
         to_state = row[4] if len(row) > 4 else None
         operator = row[5] if len(row) > 5 else None
         threshold = row[6] if len(row) > 6 else None
-        custom_message = row[7] if len(row) > 7 else None
-        log(f"rule_type: {rule_type}", level="debug")
-        log(f"from_state: {from_state}", level="debug")
-        log(f"to_state: {to_state}", level="debug")
-        log(f"operator: {operator}", level="debug")
-        log(f"threshold: {threshold}", level="debug")
-        log(f"custom_message: {custom_message}", level="debug")
+        log(f"rule: {rule_type} {from_state}->{to_state} {operator}{threshold}", level="debug")
 
         should_notify = False
-        reason = ""
 
         # --- Rule evaluation ---
         if not rule_type or rule_type == "any":
@@ -136,64 +213,39 @@ async def notify_watchers(bot, entity_id, old_state, new_state, old_attrs=None,
             if (from_state == "any" or from_state == old_state) and (to_state == "any" or new_state == to_state):
                 should_notify = True
         elif rule_type == "threshold":
-            try:
-                new_val = float(new_state)
-                thresh_val = float(threshold)
-                if operator == ">=" and new_val >= thresh_val:
-                    should_notify = True
-                elif operator == "<=" and new_val <= thresh_val:
-                    should_notify = True
-                elif operator == ">" and new_val > thresh_val:
-                    should_notify = True
-                elif operator == "<" and new_val < thresh_val:
-                    should_notify = True
-            except (ValueError, TypeError):
-                log(f"Could not evaluate threshold for {entity_id}: {new_state}", color="YELLOW", icon="⚠️")
-
-        # NEW: brightness change notices (implicit, opt-in if entity is a watched light)
-        # If user is watching this entity (any rule) and it’s a light, notify on brightness change over threshold.
-        # This happens in addition to (not instead of) state rules, but only when enabled in config.
-        if not should_notify and BRIGHTNESS_NOTIFICATIONS and entity_id.startswith("light."):
-            ob = (old_attrs or {}).get("brightness") if isinstance(old_attrs, dict) else None
-            nb = (new_attrs or {}).get("brightness") if isinstance(new_attrs, dict) else None
-            if _brightness_changed_enough(ob, nb):
-                ob_pct, nb_pct = _bri_to_pct(ob), _bri_to_pct(nb)
-                # Construct a brightness-specific message
-                delta_pct = (abs(int(nb) - int(ob)) * 100 / 255) if (ob is not None and nb is not None) else None
-                direction = "↑" if (ob is not None and nb is not None and nb > ob) else ("↓" if (ob is not None and nb is not None and nb < ob) else "")
-                reason = f"brightness change {direction} ({ob_pct}% → {nb_pct}%, Δ≈{round(delta_pct)}%)"
-                should_notify = True
-
-        if should_notify:
-            message = custom_message or f"`{display_name}` changed to `{mapped_new_state}`"
-            message = message.replace("{old_state}", str(mapped_old_state))\
-                               .replace("{new_state}", str(mapped_new_state))\
-                               .replace("{display_name}", display_name)\
-                               .replace("{entity_id}", entity_id)\
-                               .replace("{timestamp}", timestamp)
+            # Only crossed rules reach this point (see threshold_index above).
+            should_notify = True
+        elif rule_type == "attribute":
+            should_notify = predicate_for_row(row).matches(old_attrs, new_attrs)
 
-            try:
-                # If we prepared an embed+attachment icon, put the message in the embed
-                # so the thumbnail shows without needing external hosting.
-                if embed and icon_file:
-                    embed.description = message
-                    await webhook.send(
-                        username=display_name,
-                        embed=embed,
-                        file=icon_file
-                    )
-                else:
-                    # No icon available — send a plain text message.
-                    await webhook.send(
-                        content=message,
-                        username=display_name
-                    )
-            except Exception as e:
-                log(f"Failed to send webhook for {entity_id}: {e}", color="YELLOW", icon="⚠️")
-        else:
+        if not should_notify:
             log(
-                f"Skipped notify: rule not matched for {entity_id} in {channel.guild.name} ({channel.guild.id}) #{channel.name} ({channel_id})",
+                f"Skipped notify: rule not matched for {entity_id} in {channel.guild.name} ({channel.guild.id}) #{channel.name} ({channel.id})",
                 color="WHITE",
                 icon="⚙️"
             )
+            continue
 
+        mark(trace, "match")
+        matched.append((channel, row))
+
+    await _dispatch(entity_id, details, old_state, new_state, matched, trace, old_attrs=old_attrs, new_attrs=new_attrs)
+
+async def notify_duration_elapsed(bot, entity_id, watch_id, channel_id, state, since):
+    """Timer callback for `for <duration>` rules (see duration_rules.start_duration_timers)."""
+    row = get_watch(watch_id)
+    if row is None:
+        # Watch was deleted while the timer was pending.
+        return
+    channel = _resolve_channel(bot, row)
+    if not channel:
+        return
+    # The timer may have been restored after a restart, or an event may have been missed while
+    # disconnected: confirm against HA that the condition still holds before notifying.
+    current = await fetch_entity_state(entity_id)
+    if current is not None and not holds(row, state, current):
+        log(f"Dropped duration timer for {entity_id} (watch {watch_id}): now {current}, armed in {state}", level="debug")
+        return
+    details = await fetch_entity_details(entity_id)
+    log(f"{entity_id} held {state} for {format_duration(row[9])} (watch {watch_id})", level="debug")
+    await _dispatch(entity_id, details, state, state, [(channel, row)], held_for=row[9])
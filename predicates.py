@@ -0,0 +1,113 @@
+"""Attribute conditions (`attr:battery_level < 20`, `attr:media_title changes`), compiled once.
+
+Grammar:
+  attr:<name> <op> <value>      op is one of < <= > >= == !=; fires when the comparison becomes true
+  attr:<name> changes           fires whenever the attribute's value changes
+  attr:<name> changes by <n>    ... by at least n (numeric attributes)
+
+A condition is parsed into an AttributePredicate when the watch is added. Predicates are cached
+by their stored spec (the rule's attribute, operator, threshold and to_state columns), so the
+event path only does a dict lookup per rule.
+"""
+import operator as _op
+import re
+
+_COMPARATORS = {"<": _op.lt, "<=": _op.le, ">": _op.gt, ">=": _op.ge, "==": _op.eq, "!=": _op.ne}
+_CONDITION = re.compile(
+    r"^attr:(?P<attribute>[A-Za-z0-9_]+)\s*"
+    r"(?:(?P<changes>changes)(?:\s+by\s+(?P<delta>\S+))?|(?P<op><=|>=|==|!=|=|<|>)\s*(?P<value>.+))$",
+    re.IGNORECASE
+)
+
+def is_attribute_condition(condition):
+    return (condition or "").strip().lower().startswith("attr:")
+
+def _as_number(value):
+    if isinstance(value, bool):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+class AttributePredicate:
+    __slots__ = ("attribute", "operator", "threshold", "value", "_compare")
+
+    def __init__(self, attribute, operator, threshold=None, value=None):
+        self.attribute = attribute
+        self.operator = operator        # a comparator, or "changes"
+        self.threshold = threshold      # numeric operand, or the minimum delta for "changes"
+        self.value = value              # non-numeric operand for == / !=
+        self._compare = _COMPARATORS.get(operator)
+
+    def spec(self):
+        """(attribute, operator, threshold, value) as stored on the rule."""
+        return (self.attribute, self.operator, self.threshold, self.value)
+
+    def describe(self):
+        if self.operator == "changes":
+            return f"attr:{self.attribute} changes" + (f" by {self.threshold:g}" if self.threshold else "")
+        operand = f"{self.threshold:g}" if self.threshold is not None else self.value
+        return f"attr:{self.attribute} {self.operator} {operand}"
+
+    def holds(self, attrs):
+        current = (attrs or {}).get(self.attribute)
+        if current is None or self._compare is None:
+            return False
+        if self.threshold is not None:
+            number = _as_number(current)
+            return number is not None and self._compare(number, self.threshold)
+        return self._compare(str(current), self.value)
+
+    def matches(self, old_attrs, new_attrs):
+        """True if this change should notify: the comparison became true, or the value changed (enough)."""
+        if self.operator == "changes":
+            old = (old_attrs or {}).get(self.attribute)
+            new = (new_attrs or {}).get(self.attribute)
+            if old == new:
+                return False
+            if not self.threshold:
+                return True
+            old_n, new_n = _as_number(old), _as_number(new)
+            return old_n is not None and new_n is not None and abs(new_n - old_n) >= self.threshold
+        return self.holds(new_attrs) and not self.holds(old_attrs)
+
+_compiled = {}   # spec -> AttributePredicate
+
+def compile_condition(condition):
+    """Parse an `attr:` condition into a (cached) AttributePredicate. Raises ValueError with a user-facing message."""
+    m = _CONDITION.match((condition or "").strip())
+    if not m:
+        raise ValueError(
+            "Attribute conditions look like `attr:battery_level < 20`, `attr:media_title changes` "
+            "or `attr:brightness changes by 13`."
+        )
+    attribute = m.group("attribute")
+    if m.group("changes"):
+        delta = None
+        if m.group("delta") is not None:
+            delta = _as_number(m.group("delta"))
+            if delta is None or delta <= 0:
+                raise ValueError(f"`changes by` needs a positive number, got `{m.group('delta')}`.")
+        return predicate_for(attribute, "changes", delta, None)
+
+    op = "==" if m.group("op") == "=" else m.group("op")
+    raw = m.group("value").strip().strip("\"'")
+    number = _as_number(raw)
+    if op in ("<", "<=", ">", ">=") and number is None:
+        raise ValueError(f"`{op}` needs a number, got `{raw}`.")
+    if number is not None:
+        return predicate_for(attribute, op, number, None)
+    return predicate_for(attribute, op, None, raw)
+
+def predicate_for(attribute, operator, threshold, value):
+    """The compiled predicate for a stored spec (compiling it on first use, e.g. after a restart)."""
+    key = (attribute, operator, threshold, value)
+    predicate = _compiled.get(key)
+    if predicate is None:
+        predicate = _compiled[key] = AttributePredicate(attribute, operator, threshold, value)
+    return predicate
+
+def predicate_for_row(row):
+    """Compiled predicate for a watch row (get_watchers shape) of rule_type 'attribute'."""
+    return predicate_for(row[11], row[5], row[6], row[4])
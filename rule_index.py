@@ -0,0 +1,138 @@
+"""Event-path index for pattern rules (targets that are not a single literal entity_id).
+
+Targets are stored in watched_entities.entity_id as:
+  domain:<domain>             e.g. domain:lock
+  device_class:<class>        e.g. device_class:moisture
+  area:<area id or name>      e.g. area:kitchen
+  <entity_id glob>            e.g. sensor.*_battery
+
+domain/device_class/area targets live in exact-match maps; globs live in a character trie
+keyed by their literal prefix, so a lookup only walks the entity_id once and fnmatch-checks
+the few globs whose prefix matched. The index is rebuilt when db.watch_generation() moves.
+"""
+import asyncio
+import time
+from fnmatch import fnmatchcase
+from colorama import Fore
+
+from db import get_pattern_watchers, watch_generation
+from ha_api import fetch_area_map
+from utils import log
+
+AREA_REFRESH_SECONDS = 300
+_KEYED_KINDS = ("domain", "device_class", "area")
+_GLOB_CHARS = "*?["
+
+def is_pattern_target(target):
+    return bool(target) and (":" in target or any(ch in target for ch in _GLOB_CHARS))
+
+def parse_pattern_target(target):
+    """Return (kind, value) for a pattern target, or None if it isn't one we understand."""
+    target = (target or "").strip()
+    if ":" in target:
+        kind, _, value = target.partition(":")
+        if kind in _KEYED_KINDS and value:
+            return kind, value.lower() if kind == "area" else value
+        return None
+    if any(ch in target for ch in _GLOB_CHARS):
+        return "glob", target
+    return None
+
+class _TrieNode:
+    __slots__ = ("children", "globs")
+
+    def __init__(self):
+        self.children = {}
+        self.globs = []   # [(pattern, row), ...] whose literal prefix ends here
+
+class _PatternIndex:
+    def __init__(self, rows):
+        self.keyed = {kind: {} for kind in _KEYED_KINDS}
+        self.root = _TrieNode()
+        self.size = 0
+        for target, *row in rows:
+            parsed = parse_pattern_target(target)
+            if not parsed:
+                continue
+            kind, value = parsed
+            row = tuple(row)
+            if kind == "glob":
+                self._insert_glob(value, row)
+            else:
+                self.keyed[kind].setdefault(value, []).append(row)
+            self.size += 1
+
+    def _insert_glob(self, pattern, row):
+        node = self.root
+        for ch in pattern:
+            if ch in _GLOB_CHARS:
+                break
+            node = node.children.setdefault(ch, _TrieNode())
+        node.globs.append((pattern, row))
+
+    def match(self, entity_id, device_class, area):
+        matched = list(self.keyed["domain"].get(entity_id.split(".", 1)[0], ()))
+        if device_class:
+            matched += self.keyed["device_class"].get(device_class, ())
+        if area:
+            for key in area:
+                matched += self.keyed["area"].get(key, ())
+        node = self.root
+        for ch in entity_id:
+            matched += [row for pattern, row in node.globs if fnmatchcase(entity_id, pattern)]
+            node = node.children.get(ch)
+            if node is None:
+                break
+        else:
+            matched += [row for pattern, row in node.globs if fnmatchcase(entity_id, pattern)]
+        return matched
+
+# --- Module state ---
+_index = None
+_index_generation = -1
+_areas = {}          # entity_id -> (area_id, area_name)
+_areas_loaded_at = 0.0
+_area_refresh = None
+
+def _current_index():
+    global _index, _index_generation
+    generation = watch_generation()
+    if _index is None or generation != _index_generation:
+        _index = _PatternIndex(get_pattern_watchers())
+        _index_generation = generation
+        if _index.size:
+            log(f"Pattern rule index rebuilt ({_index.size} rules)", level="DEBUG", icon="🗂️")
+    return _index
+
+async def _refresh_areas():
+    global _areas, _areas_loaded_at
+    try:
+        areas = await fetch_area_map()
+        if areas is not None:
+            _areas = areas
+    except Exception as e:
+        log(f"Failed to refresh area map: {e}", level="WARNING", color=Fore.YELLOW, icon="⚠️")
+    _areas_loaded_at = time.monotonic()
+
+async def _area_keys(entity_id):
+    global _area_refresh
+    stale = time.monotonic() - _areas_loaded_at > AREA_REFRESH_SECONDS
+    if not _areas_loaded_at:
+        await _refresh_areas()
+    elif stale and (_area_refresh is None or _area_refresh.done()):
+        # Keep serving the previous map while the refresh runs.
+        _area_refresh = asyncio.create_task(_refresh_areas())
+    area = _areas.get(entity_id)
+    if not area:
+        return None
+    area_id, area_name = area
+    return {area_id.lower(), area_name.lower()} - {""}
+
+async def match_pattern_watchers(entity_id, attrs=None):
+    """Rows (same shape as db.get_watchers) of every pattern rule that covers `entity_id`."""
+    index = _current_index()
+    if not index.size or not entity_id:
+        return []
+    device_class = (attrs or {}).get("device_class") if isinstance(attrs, dict) else None
+    area = await _area_keys(entity_id) if index.keyed["area"] else None
+    return index.match(entity_id, device_class, area)
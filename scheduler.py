@@ -0,0 +1,173 @@
+"""Priority-aware dispatch of outgoing notifications.
+
+Every send is queued with a priority class. Workers always take the most urgent job first,
+and one worker is reserved for critical/high work so a safety alert never waits behind a
+backlog of routine sends. Under overload, queued low/normal jobs with the same coalesce key
+(same channel, entity and rule) collapse into the newest one, and beyond the queue cap the
+oldest low-priority jobs are shed first.
+"""
+import asyncio
+import heapq
+import itertools
+import time
+from collections import deque
+from colorama import Fore
+
+from config import SCHEDULER_WORKERS, SCHEDULER_MAX_QUEUE
+from utils import log
+
+PRIORITY_CLASSES = ("critical", "high", "normal", "low")
+_RANK = {name: rank for rank, name in enumerate(PRIORITY_CLASSES)}
+_URGENT_RANK = _RANK["high"]
+
+# Defaults when a watch has no explicit priority.
+CRITICAL_DEVICE_CLASSES = {"smoke", "gas", "carbon_monoxide", "moisture", "safety"}
+HIGH_DEVICE_CLASSES = {"problem", "tamper", "heat", "cold", "garage_door", "lock"}
+LOW_DEVICE_CLASSES = {"motion", "occupancy", "moving", "vibration", "sound", "light", "illuminance"}
+HIGH_DOMAINS = {"alarm_control_panel", "lock", "siren"}
+LOW_DOMAINS = {"light", "media_player", "sun"}
+
+LATENCY_SAMPLES = 500
+# Coalescing only kicks in once this many jobs are waiting; below it every notification is sent.
+COALESCE_BACKLOG = max(SCHEDULER_MAX_QUEUE // 4, 1)
+
+def classify(entity_id, device_class=None, explicit=None):
+    """Priority class for a notification: explicit per-watch setting, else device_class, else domain."""
+    if explicit in _RANK:
+        return explicit
+    if device_class in CRITICAL_DEVICE_CLASSES:
+        return "critical"
+    if device_class in HIGH_DEVICE_CLASSES:
+        return "high"
+    if device_class in LOW_DEVICE_CLASSES:
+        return "low"
+    domain = (entity_id or "").split(".", 1)[0]
+    if domain in HIGH_DOMAINS:
+        return "high"
+    if domain in LOW_DOMAINS:
+        return "low"
+    return "normal"
+
+class _Job:
+    __slots__ = ("rank", "seq", "send", "enqueued", "key", "dead")
+
+    def __init__(self, rank, seq, send, key):
+        self.rank = rank
+        self.seq = seq
+        self.send = send
+        self.enqueued = time.monotonic()
+        self.key = key
+        self.dead = False
+
+    def __lt__(self, other):
+        return (self.rank, self.seq) < (other.rank, other.seq)
+
+# --- Module state ---
+_heap = []
+_live = 0                 # jobs in _heap that aren't dead
+_coalescable = {}         # (channel_id, entity_id) -> pending low/normal _Job
+_wakeup = None
+_workers = []
+_seq = itertools.count()
+_latency = {name: deque(maxlen=LATENCY_SAMPLES) for name in PRIORITY_CLASSES}
+_counters = {name: {"sent": 0, "coalesced": 0, "shed": 0, "failed": 0} for name in PRIORITY_CLASSES}
+
+def _ensure_workers():
+    global _wakeup
+    if _wakeup is None:
+        _wakeup = asyncio.Condition()
+    if not _workers:
+        # Worker 0 only serves critical/high, so urgent sends always have a free slot.
+        _workers.append(asyncio.ensure_future(_worker(_URGENT_RANK)))
+        for _ in range(max(SCHEDULER_WORKERS - 1, 1)):
+            _workers.append(asyncio.ensure_future(_worker(_RANK["low"])))
+
+def _shed():
+    """Drop the oldest job of the least urgent class (never critical/high) until under the cap."""
+    global _live
+    while _live > SCHEDULER_MAX_QUEUE:
+        victims = [job for job in _heap if not job.dead and job.rank > _URGENT_RANK]
+        if not victims:
+            return
+        victim = max(victims, key=lambda job: (job.rank, -job.seq))
+        victim.dead = True
+        _live -= 1
+        if victim.key is not None and _coalescable.get(victim.key) is victim:
+            del _coalescable[victim.key]
+        _counters[PRIORITY_CLASSES[victim.rank]]["shed"] += 1
+        log(f"Scheduler overloaded: shed a {PRIORITY_CLASSES[victim.rank]} notification", level="WARNING", color=Fore.YELLOW, icon="🪣")
+
+async def submit(priority, send, coalesce_key=None):
+    """Queue `send` (a zero-argument coroutine function) under `priority`.
+
+    Once the backlog passes COALESCE_BACKLOG, a low/normal job replaces a still-queued job
+    with the same `coalesce_key` instead of queueing behind it.
+    """
+    global _live
+    _ensure_workers()
+    rank = _RANK.get(priority, _RANK["normal"])
+    if coalesce_key is not None and rank > _URGENT_RANK and _live >= COALESCE_BACKLOG:
+        pending = _coalescable.get(coalesce_key)
+        if pending is not None and not pending.dead and pending.rank == rank:
+            pending.send = send
+            _counters[priority]["coalesced"] += 1
+            return
+    job = _Job(rank, next(_seq), send, coalesce_key if rank > _URGENT_RANK else None)
+    heapq.heappush(_heap, job)
+    _live += 1
+    if job.key is not None:
+        _coalescable[job.key] = job
+    _shed()
+    async with _wakeup:
+        _wakeup.notify_all()
+
+def _pop(max_rank):
+    global _live
+    while _heap and _heap[0].dead:
+        heapq.heappop(_heap)
+    if not _heap or _heap[0].rank > max_rank:
+        return None
+    job = heapq.heappop(_heap)
+    _live -= 1
+    if job.key is not None and _coalescable.get(job.key) is job:
+        del _coalescable[job.key]
+    return job
+
+async def _worker(max_rank):
+    while True:
+        async with _wakeup:
+            job = _pop(max_rank)
+            while job is None:
+                await _wakeup.wait()
+                job = _pop(max_rank)
+        name = PRIORITY_CLASSES[job.rank]
+        try:
+            await job.send()
+            _counters[name]["sent"] += 1
+        except Exception as e:
+            _counters[name]["failed"] += 1
+            log(f"Scheduled {name} notification failed: {e}", level="DEBUG")
+        _latency[name].append(time.monotonic() - job.enqueued)
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    return sorted_values[min(int(len(sorted_values) * pct / 100), len(sorted_values) - 1)]
+
+def latency_summary():
+    """Per-class queue depth, counters and enqueue→sent latency percentiles (seconds)."""
+    queued = {name: 0 for name in PRIORITY_CLASSES}
+    for job in _heap:
+        if not job.dead:
+            queued[PRIORITY_CLASSES[job.rank]] += 1
+    summary = {}
+    for name in PRIORITY_CLASSES:
+        samples = sorted(_latency[name])
+        summary[name] = {
+            "queued": queued[name],
+            **_counters[name],
+            "p50": _percentile(samples, 50),
+            "p95": _percentile(samples, 95),
+            "max": samples[-1] if samples else None,
+        }
+    return summary
@@ -0,0 +1,77 @@
+"""Per-entity sorted index of threshold rules.
+
+A threshold rule fires when the entity's value *crosses* into its condition: the old value did
+not satisfy it and the new one does. With every rule's threshold kept in a sorted array per
+operator, the rules crossed by old → new form one contiguous slice of each array, found with
+two binary searches — O(log n + k) per operator instead of checking (and float()-parsing)
+every rule.
+"""
+from bisect import bisect_left, bisect_right
+
+from db import watch_generation
+
+OPERATORS = (">", ">=", "<", "<=")
+
+def _as_number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+class ThresholdIndex:
+    __slots__ = ("thresholds", "rows", "size")
+
+    def __init__(self, rows):
+        """`rows` are watch rows (as from get_watchers) with rule_type 'threshold'."""
+        by_op = {op: [] for op in OPERATORS}
+        self.size = 0
+        for row in rows:
+            value = _as_number(row[6])
+            if row[5] in by_op and value is not None:
+                by_op[row[5]].append((value, row))
+                self.size += 1
+        for entries in by_op.values():
+            entries.sort(key=lambda e: e[0])
+        self.thresholds = {op: [v for v, _ in entries] for op, entries in by_op.items()}
+        self.rows = {op: [r for _, r in entries] for op, entries in by_op.items()}
+
+    def _slice(self, op, lo, hi):
+        return self.rows[op][lo:hi] if lo < hi else []
+
+    def crossed(self, old_value, new_value):
+        """Rows whose condition is false for `old_value` (or it isn't numeric) and true for `new_value`."""
+        new = _as_number(new_value)
+        if new is None:
+            return []
+        old = _as_number(old_value)
+        t = self.thresholds
+        out = []
+        # v > t  ⇔  t < v          crossed: old <= t < new
+        out += self._slice(">", 0 if old is None else bisect_left(t[">"], old), bisect_left(t[">"], new))
+        # v >= t ⇔  t <= v         crossed: old < t <= new
+        out += self._slice(">=", 0 if old is None else bisect_right(t[">="], old), bisect_right(t[">="], new))
+        # v < t  ⇔  t > v          crossed: new < t <= old
+        out += self._slice("<", bisect_right(t["<"], new), len(t["<"]) if old is None else bisect_right(t["<"], old))
+        # v <= t ⇔  t >= v         crossed: new <= t < old
+        out += self._slice("<=", bisect_left(t["<="], new), len(t["<="]) if old is None else bisect_left(t["<="], old))
+        return out
+
+_indexes = {}   # entity_id -> (watch generation, ThresholdIndex, row count)
+
+def threshold_index(entity_id, rows):
+    """Cached ThresholdIndex for `entity_id`, rebuilt when watches change.
+
+    `rows` are the entity's current threshold rows; they're only read on a rebuild (or when
+    their count no longer matches, e.g. a pattern rule started or stopped matching).
+    """
+    generation = watch_generation()
+    cached = _indexes.get(entity_id)
+    if cached is not None and cached[0] == generation and len(rows) == cached[2]:
+        return cached[1]
+    index = ThresholdIndex(rows)
+    _indexes[entity_id] = (generation, index, len(rows))
+    if cached is not None and cached[0] != generation:
+        # Watches changed; drop indexes built against older generations.
+        for eid in [e for e, c in _indexes.items() if c[0] != generation]:
+            del _indexes[eid]
+    return index
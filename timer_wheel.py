@@ -0,0 +1,87 @@
+"""Hierarchical timer wheel: O(1) schedule and cancel for large numbers of coarse timers.
+
+Level 0 has SLOTS slots of one tick each, level 1 SLOTS slots of SLOTS ticks each, and so on.
+A timer sits in the coarsest level that still resolves its deadline; when a lower level wraps
+around, the next slot of the level above is cascaded down. Each slot is a dict keyed by timer
+key, so cancelling is a dict delete. Five levels of 64 one-second slots reach about 34 years.
+"""
+import time
+
+SLOTS = 64
+LEVELS = 5
+
+class Timer:
+    __slots__ = ("key", "deadline", "payload", "tick", "level", "slot")
+
+    def __init__(self, key, deadline, payload, tick):
+        self.key = key
+        self.deadline = deadline
+        self.payload = payload
+        self.tick = tick
+        self.level = 0
+        self.slot = 0
+
+class TimerWheel:
+    def __init__(self, tick_seconds=1.0, now=None):
+        self.tick_seconds = tick_seconds
+        self._wheels = [[{} for _ in range(SLOTS)] for _ in range(LEVELS)]
+        self._timers = {}
+        self._now_tick = int((time.time() if now is None else now) / tick_seconds)
+
+    def __len__(self):
+        return len(self._timers)
+
+    def __contains__(self, key):
+        return key in self._timers
+
+    def get(self, key):
+        return self._timers.get(key)
+
+    def schedule(self, key, deadline, payload=None):
+        """Arm (or re-arm) `key` to expire at epoch `deadline`. Overdue deadlines fire on the next tick."""
+        self.cancel(key)
+        tick = max(int(-(-deadline // self.tick_seconds)), self._now_tick + 1)
+        timer = Timer(key, deadline, payload, tick)
+        self._timers[key] = timer
+        self._place(timer)
+        return timer
+
+    def cancel(self, key):
+        """Disarm `key`. Returns the cancelled Timer, or None if it wasn't pending."""
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            del self._wheels[timer.level][timer.slot][key]
+        return timer
+
+    def _place(self, timer):
+        delta = timer.tick - self._now_tick
+        level = 0
+        while level < LEVELS - 1 and delta >= SLOTS ** (level + 1):
+            level += 1
+        timer.level = level
+        timer.slot = (timer.tick // SLOTS ** level) % SLOTS
+        self._wheels[level][timer.slot][timer.key] = timer
+
+    def _cascade(self, level):
+        slot = (self._now_tick // SLOTS ** level) % SLOTS
+        bucket, self._wheels[level][slot] = self._wheels[level][slot], {}
+        for timer in bucket.values():
+            self._place(timer)
+
+    def advance(self, now=None):
+        """Move the wheel up to `now` and return the timers that expired, in deadline order."""
+        target = int((time.time() if now is None else now) / self.tick_seconds)
+        expired = []
+        while self._now_tick < target:
+            self._now_tick += 1
+            # Cascade from the top so timers can fall through several levels on one tick.
+            for level in range(LEVELS - 1, 0, -1):
+                if self._now_tick % SLOTS ** level == 0:
+                    self._cascade(level)
+            slot = self._now_tick % SLOTS
+            bucket, self._wheels[0][slot] = self._wheels[0][slot], {}
+            for timer in bucket.values():
+                del self._timers[timer.key]
+                expired.append(timer)
+        expired.sort(key=lambda t: t.deadline)
+        return expired
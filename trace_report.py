@@ -0,0 +1,58 @@
+"""Offline analyzer for tracing.py output: per-stage latency percentiles.
+
+Usage: python trace_report.py [traces.jsonl ...]   (defaults to every process's trace file and its rotated backups)
+"""
+import json
+import sys
+from pathlib import Path
+
+from config import TRACE_PATH
+from tracing import STAGES
+
+PERCENTILES = (50, 90, 99)
+
+def _default_paths():
+    # traces.jsonl, traces.worker0.jsonl, traces.ingest.jsonl, ... plus their .1, .2 rotations
+    return sorted(TRACE_PATH.parent.glob(f"{TRACE_PATH.stem}*{TRACE_PATH.suffix}*"))
+
+def _percentile(sorted_values, pct):
+    return sorted_values[min(int(len(sorted_values) * pct / 100), len(sorted_values) - 1)]
+
+def collect(paths):
+    """Return {label: [milliseconds, ...]} for each adjacent stage pair and end to end."""
+    spans = {}
+    for path in paths:
+        with open(path) as fh:
+            for line in fh:
+                try:
+                    t = json.loads(line)["t"]
+                except (ValueError, KeyError):
+                    continue
+                present = [stage for stage in STAGES if stage in t]
+                for a, b in zip(present, present[1:]):
+                    spans.setdefault(f"{a} → {b}", []).append((t[b] - t[a]) * 1000)
+                if len(present) > 1:
+                    spans.setdefault(f"total {present[0]} → {present[-1]}", []).append((t[present[-1]] - t[present[0]]) * 1000)
+    return spans
+
+def main(argv):
+    paths = [Path(p) for p in argv] or _default_paths()
+    if not paths:
+        print(f"No trace files found (looked for {TRACE_PATH.parent / (TRACE_PATH.stem + '*' + TRACE_PATH.suffix)}). Set TRACE_SAMPLE_RATE to record some.")
+        return 1
+    spans = collect(paths)
+    header = f"{'stage':<28}{'n':>8}" + "".join(f"{'p' + str(p):>10}" for p in PERCENTILES) + f"{'max':>10}"
+    print(header)
+    print("-" * len(header))
+    order = {f"{a} → {b}": i for i, (a, b) in enumerate(zip(STAGES, STAGES[1:]))}
+    for label in sorted(spans, key=lambda k: (k.startswith("total"), order.get(k, len(order)), k)):
+        values = sorted(spans[label])
+        row = f"{label:<28}{len(values):>8}"
+        row += "".join(f"{_percentile(values, p):>10.1f}" for p in PERCENTILES)
+        row += f"{values[-1]:>10.1f}"
+        print(row)
+    print("(milliseconds)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,73 @@
+"""Sampled per-event latency traces, written as JSON lines to a rotating file per process.
+
+A trace is a plain dict so it can ride along through the pipeline (and over IPC):
+  {"entity_id": ..., "t": {stage: epoch_seconds, ...}}
+Stages, in pipeline order, are listed in STAGES; trace_report.py turns them into percentiles.
+"""
+import json
+import logging
+import random
+import time
+from logging.handlers import RotatingFileHandler
+
+from config import TRACE_SAMPLE_RATE, TRACE_PATH, TRACE_MAX_BYTES, TRACE_BACKUPS, HABOT_ROLE, WORKER_INDEX
+
+STAGES = (
+    "lc",        # HA last_changed
+    "recv",      # websocket frame received
+    "process",   # handled by the listener (_process_entities_event / state_changed handler)
+    "match",     # first rule matched in notify_watchers
+    "render",    # icon ready, notification queued
+    "sent",      # first webhook send completed
+)
+
+_logger = None
+
+def trace_path():
+    """This process's trace file: TRACE_PATH itself, or e.g. traces.worker2.jsonl when split into roles.
+
+    RotatingFileHandler can't share a file between processes, so each role/worker writes its own.
+    """
+    if HABOT_ROLE == "worker":
+        tag = f"worker{WORKER_INDEX}"
+    elif HABOT_ROLE == "ingest":
+        tag = "ingest"
+    else:
+        return TRACE_PATH
+    return TRACE_PATH.with_name(f"{TRACE_PATH.stem}.{tag}{TRACE_PATH.suffix}")
+
+def _get_logger():
+    global _logger
+    if _logger is None:
+        _logger = logging.getLogger("habot.traces")
+        _logger.propagate = False
+        _logger.setLevel(logging.INFO)
+        path = trace_path()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        handler = RotatingFileHandler(path, maxBytes=TRACE_MAX_BYTES, backupCount=TRACE_BACKUPS)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        _logger.addHandler(handler)
+    return _logger
+
+def start_trace(entity_id, lc=None, recv=None):
+    """Begin a trace for this event, or return None if it isn't sampled."""
+    if TRACE_SAMPLE_RATE <= 0 or random.random() >= TRACE_SAMPLE_RATE:
+        return None
+    t = {}
+    if lc is not None:
+        t["lc"] = lc
+    if recv is not None:
+        t["recv"] = recv
+    return {"entity_id": entity_id, "t": t}
+
+def mark(trace, stage):
+    """Stamp `stage` (first time only); no-op for unsampled events."""
+    if trace is not None and stage not in trace["t"]:
+        trace["t"][stage] = time.time()
+
+def finish(trace):
+    """Write the trace once; later calls (e.g. from other deliveries of the same event) are ignored."""
+    if trace is None or trace.get("done"):
+        return
+    trace["done"] = True
+    _get_logger().info(json.dumps({"entity_id": trace["entity_id"], "t": trace["t"]}, separators=(",", ":")))
@@ -0,0 +1,95 @@
+"""Append-only log of watched-entity transitions, written by a group-committing background task."""
+import asyncio
+import time
+from colorama import Fore
+
+from config import TRANSITION_BATCH_SIZE, TRANSITION_FLUSH_MS, TRANSITION_RETENTION_DAYS
+from db import insert_transitions, prune_transitions, get_transitions, get_last_seen_states
+from utils import log
+
+PRUNE_INTERVAL_SECONDS = 3600
+
+_queue = None
+_writer = None
+
+def record_transition(entity_id, old_state, new_state, ts=None):
+    """Queue one transition for the writer. Never blocks the event path."""
+    global _queue, _writer
+    if _queue is None:
+        _queue = asyncio.Queue()
+    if _writer is None or _writer.done():
+        _writer = asyncio.ensure_future(_run_writer())
+    _queue.put_nowait((ts or time.time(), entity_id, old_state, new_state))
+
+async def _flush(batch):
+    try:
+        await asyncio.to_thread(insert_transitions, batch)
+    except Exception as e:
+        log(f"Failed to write {len(batch)} transitions: {e}", level="WARNING", color=Fore.YELLOW, icon="⚠️")
+
+async def _prune():
+    cutoff = time.time() - TRANSITION_RETENTION_DAYS * 86400
+    try:
+        deleted = await asyncio.to_thread(prune_transitions, cutoff)
+        if deleted:
+            log(f"Pruned {deleted} transitions older than {TRANSITION_RETENTION_DAYS}d", level="INFO", icon="🧹")
+    except Exception as e:
+        log(f"Failed to prune transitions: {e}", level="WARNING", color=Fore.YELLOW, icon="⚠️")
+
+async def _run_writer():
+    flush_after = TRANSITION_FLUSH_MS / 1000
+    next_prune = 0.0
+    batch = []
+    try:
+        while True:
+            if time.monotonic() >= next_prune:
+                await _prune()
+                next_prune = time.monotonic() + PRUNE_INTERVAL_SECONDS
+
+            batch.append(await _queue.get())
+            deadline = time.monotonic() + flush_after
+            # Gather more until the batch is full or the oldest event has waited long enough.
+            while len(batch) < TRANSITION_BATCH_SIZE:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(_queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            await _flush(batch)
+            batch = []
+    finally:
+        while not _queue.empty():
+            batch.append(_queue.get_nowait())
+        if batch:
+            insert_transitions(batch)
+
+# ---- Queries -------------------------------------------------------------------
+def entity_stats(entity_id, period):
+    """Summarize the last `period` seconds from the local log.
+
+    Returns {"count": n, "entered": {state: n}, "durations": {state: seconds}, "last_seen": {state: ts}}.
+    Durations only cover time after the first logged transition.
+    """
+    now = time.time()
+    since = now - period
+    before, rows = get_transitions(entity_id, since)
+
+    entered, durations = {}, {}
+    state = before[2] if before else None
+    cursor = since
+    for ts, _, new_state in rows:
+        if state is not None:
+            durations[state] = durations.get(state, 0.0) + (ts - cursor)
+        entered[new_state] = entered.get(new_state, 0) + 1
+        state, cursor = new_state, ts
+    if state is not None:
+        durations[state] = durations.get(state, 0.0) + (now - cursor)
+
+    return {
+        "count": len(rows),
+        "entered": entered,
+        "durations": durations,
+        "last_seen": get_last_seen_states(entity_id),
+    }
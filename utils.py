@@ -1,7 +1,14 @@
 import datetime
 import os
+import re
+import time
 from colorama import Fore, Style
 
+# Startup timeline, measured from the first import of this module (main.py imports it first).
+_STARTUP_T0 = time.perf_counter()
+_startup_marks = []
+_startup_done = False
+
 LOG_LEVELS = {
     "DEBUG": Fore.MAGENTA,
     "INFO": Fore.CYAN,
@@ -21,3 +28,58 @@ def log(message, level="INFO", color=None, icon=None, plain=False):
     else:
         print(f"{color_code}{log_msg}{Style.RESET_ALL}")
 
+
+def startup_phase(name, final=False):
+    """Record the end of a startup phase; with STARTUP_PROFILE set, print the breakdown on `final`."""
+    global _startup_done
+    if _startup_done or any(n == name for n, _ in _startup_marks):
+        return
+    _startup_marks.append((name, time.perf_counter()))
+    if not final:
+        return
+    _startup_done = True
+    if os.getenv("STARTUP_PROFILE", "").strip().lower() not in ("1", "true", "yes", "on"):
+        return
+    log("Startup profile:", level="INFO", icon="⏱️")
+    prev = _STARTUP_T0
+    for phase, t in _startup_marks:
+        log(f"  {phase:<20} +{(t - prev) * 1000:8.1f} ms  (at {(t - _STARTUP_T0) * 1000:8.1f} ms)", level="INFO")
+        prev = t
+
+_DURATION_UNITS = {
+    "s": 1, "sec": 1, "secs": 1, "second": 1, "seconds": 1,
+    "m": 60, "min": 60, "mins": 60, "minute": 60, "minutes": 60,
+    "h": 3600, "hr": 3600, "hrs": 3600, "hour": 3600, "hours": 3600,
+    "d": 86400, "day": 86400, "days": 86400,
+    "w": 604800, "week": 604800, "weeks": 604800,
+}
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)\s*([a-z]+)")
+
+def parse_duration(text):
+    """Parse '90s', '10m', '10 minutes', '1h30m' or '7d' into seconds. Returns None if unparseable."""
+    text = (text or "").strip().lower()
+    if not text:
+        return None
+    total, pos = 0.0, 0
+    for m in _DURATION_PART.finditer(text):
+        if text[pos:m.start()].strip() or m.group(2) not in _DURATION_UNITS:
+            return None
+        total += float(m.group(1)) * _DURATION_UNITS[m.group(2)]
+        pos = m.end()
+    if pos == 0 or text[pos:].strip():
+        return None
+    return total
+
+def format_duration(seconds):
+    """Compact human duration: 45s, 12m, 3h 5m, 2d 4h."""
+    seconds = int(seconds or 0)
+    if seconds < 60:
+        return f"{seconds}s"
+    minutes, _ = divmod(seconds, 60)
+    if minutes < 60:
+        return f"{minutes}m"
+    hours, minutes = divmod(minutes, 60)
+    if hours < 24:
+        return f"{hours}h {minutes}m" if minutes else f"{hours}h"
+    days, hours = divmod(hours, 24)
+    return f"{days}d {hours}h" if hours else f"{days}d"
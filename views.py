@@ -0,0 +1,73 @@
+import nextcord
+
+class ConfirmView(nextcord.ui.View):
+    """Confirm/Cancel buttons that only the invoking user can press. `value` is True, False or None (timed out)."""
+
+    def __init__(self, user_id: int, timeout: float = 60):
+        super().__init__(timeout=timeout)
+        self.user_id = user_id
+        self.value = None
+
+    async def interaction_check(self, interaction: nextcord.Interaction) -> bool:
+        return interaction.user.id == self.user_id
+
+    @nextcord.ui.button(label="Confirm", style=nextcord.ButtonStyle.green)
+    async def confirm(self, button: nextcord.ui.Button, interaction: nextcord.Interaction):
+        self.value = True
+        await interaction.response.defer()
+        self.stop()
+
+    @nextcord.ui.button(label="Cancel", style=nextcord.ButtonStyle.grey)
+    async def cancel(self, button: nextcord.ui.Button, interaction: nextcord.Interaction):
+        self.value = False
+        await interaction.response.defer()
+        self.stop()
+
+class PaginatorView(nextcord.ui.View):
+    """◀/▶ buttons that flip a message through pre-rendered `pages` (only for the invoking user)."""
+
+    def __init__(self, pages: list[str], user_id: int, timeout: float = 300):
+        super().__init__(timeout=timeout)
+        self.pages = pages
+        self.user_id = user_id
+        self.index = 0
+        self._sync_buttons()
+
+    def _sync_buttons(self):
+        self.prev_page.disabled = self.index == 0
+        self.next_page.disabled = self.index >= len(self.pages) - 1
+        self.counter.label = f"{self.index + 1}/{len(self.pages)}"
+
+    async def interaction_check(self, interaction: nextcord.Interaction) -> bool:
+        return interaction.user.id == self.user_id
+
+    async def _show(self, interaction: nextcord.Interaction):
+        self._sync_buttons()
+        await interaction.response.edit_message(content=self.pages[self.index], view=self)
+
+    @nextcord.ui.button(label="◀", style=nextcord.ButtonStyle.grey)
+    async def prev_page(self, button: nextcord.ui.Button, interaction: nextcord.Interaction):
+        self.index = max(self.index - 1, 0)
+        await self._show(interaction)
+
+    @nextcord.ui.button(label="1/1", style=nextcord.ButtonStyle.grey, disabled=True)
+    async def counter(self, button: nextcord.ui.Button, interaction: nextcord.Interaction):
+        pass
+
+    @nextcord.ui.button(label="▶", style=nextcord.ButtonStyle.grey)
+    async def next_page(self, button: nextcord.ui.Button, interaction: nextcord.Interaction):
+        self.index = min(self.index + 1, len(self.pages) - 1)
+        await self._show(interaction)
+
+def paginate(header: str, lines: list[str], limit: int = 1900) -> list[str]:
+    """Split `lines` into messages under Discord's 2000-char limit, each starting with `header`."""
+    pages, current = [], header
+    for line in lines:
+        if len(line) > limit - len(header) - 1:
+            line = line[:limit - len(header) - 2] + "…"
+        if len(current) + 1 + len(line) > limit:
+            pages.append(current)
+            current = header
+        current += "\n" + line
+    pages.append(current)
+    return pages
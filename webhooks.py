@@ -0,0 +1,89 @@
+import asyncio
+import time
+from collections import deque
+import nextcord
+from colorama import Fore
+
+from config import WEBHOOK_POOL_MAX, WEBHOOK_BUSY_SENDS, WEBHOOK_BUSY_WINDOW, WEBHOOK_ORDERED_CHANNELS
+from utils import log
+
+WEBHOOK_NAME = "HA Bot"
+
+# --- Per-channel state ---
+_pools = {}        # channel_id -> [Webhook, ...]
+_cursor = {}       # channel_id -> round-robin position
+_recent = {}       # channel_id -> deque of recent send times (busy detection)
+_pool_locks = {}   # channel_id -> Lock guarding webhook lookup/creation
+_order_locks = {}  # channel_id -> Lock serializing sends in ordered channels
+
+def _lock(table, channel_id):
+    lock = table.get(channel_id)
+    if lock is None:
+        lock = table[channel_id] = asyncio.Lock()
+    return lock
+
+def _is_busy(channel_id):
+    now = time.monotonic()
+    recent = _recent.setdefault(channel_id, deque())
+    recent.append(now)
+    while recent and now - recent[0] > WEBHOOK_BUSY_WINDOW:
+        recent.popleft()
+    return len(recent) >= WEBHOOK_BUSY_SENDS
+
+async def _ensure_pool(channel, want):
+    """Make sure the channel has at least `want` of our webhooks (adopting existing ones first)."""
+    async with _lock(_pool_locks, channel.id):
+        pool = _pools.get(channel.id)
+        if pool is None:
+            pool = [
+                wh for wh in await channel.webhooks()
+                if wh.user and wh.user.id == channel.guild.me.id
+            ][:WEBHOOK_POOL_MAX]
+            _pools[channel.id] = pool
+        while len(pool) < want:
+            pool.append(await channel.create_webhook(name=WEBHOOK_NAME))
+            if len(pool) > 1:
+                log(f"Webhook pool for #{channel.name} ({channel.id}) grown to {len(pool)}", level="INFO", color=Fore.CYAN, icon="🪝")
+        return pool
+
+def _evict(channel_id, webhook):
+    pool = _pools.get(channel_id) or []
+    if webhook in pool:
+        pool.remove(webhook)
+
+async def get_webhook(channel: nextcord.TextChannel) -> nextcord.Webhook:
+    """Return the next webhook for `channel`, growing the pool when the channel is busy."""
+    ordered = channel.id in WEBHOOK_ORDERED_CHANNELS
+    pool = _pools.get(channel.id) or []
+    want = max(len(pool), 1)
+    if not ordered and _is_busy(channel.id) and want < WEBHOOK_POOL_MAX:
+        want += 1
+    if len(pool) < want:
+        pool = await _ensure_pool(channel, want)
+    if ordered:
+        return pool[0]
+    i = _cursor.get(channel.id, 0) % len(pool)
+    _cursor[channel.id] = i + 1
+    return pool[i]
+
+async def _send(channel, kwargs):
+    for attempt in (1, 2):
+        webhook = await get_webhook(channel)
+        try:
+            return await webhook.send(**kwargs)
+        except nextcord.NotFound:
+            # Someone deleted the webhook out from under us: drop it and recreate transparently.
+            _evict(channel.id, webhook)
+            log(f"Webhook {webhook.id} in #{channel.name} ({channel.id}) is gone; recreating", level="WARNING", color=Fore.YELLOW, icon="🪝")
+            if attempt == 2:
+                raise
+            file = kwargs.get("file")
+            if file is not None:
+                file.reset()
+
+async def send_webhook(channel: nextcord.TextChannel, **kwargs):
+    """Send through the channel's webhook pool; ordered channels are serialized on one webhook."""
+    if channel.id in WEBHOOK_ORDERED_CHANNELS:
+        async with _lock(_order_locks, channel.id):
+            return await _send(channel, kwargs)
+    return await _send(channel, kwargs)